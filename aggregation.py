@@ -0,0 +1,76 @@
+# ================= 部位彙總引擎 (幣種 / 天期 / 日期) =================
+# 每份快照只建一次：把 loans / offers / matched_trades 正規化成欄位一致的 DataFrame，
+# 再以 groupby 向量化計算金額、加權年化、筆數與平均天期，避免各處手寫 sum() 混算不同幣種。
+# 放貸合約 (loans) 的 payload 只有剩餘秒數 (_sort_sec)、沒有原始天期，因此不納入天期分佈。
+import numpy as np
+import pandas as pd
+
+DEFAULT_CURRENCY = "USDT"
+PERIOD_BINS = [0, 2, 7, 30, 120, np.inf]
+PERIOD_LABELS = ["≤2天", "3-7天", "8-30天", "31-120天", ">120天"]
+COLUMNS = ["currency", "amount", "rate", "period", "date"]
+
+
+def _column(df, names, default=np.nan):
+    for name in names:
+        if name in df.columns: return df[name]
+    return pd.Series(default, index=df.index)
+
+
+def _numeric(series):
+    # 容忍 "2天"、"10.5%" 之類的字串欄位
+    if not pd.api.types.is_numeric_dtype(series):
+        series = series.astype(str).str.extract(r"(-?\d+(?:\.\d+)?)", expand=False)
+    return pd.to_numeric(series, errors="coerce")
+
+
+def normalize(rows, amount_keys, rate_keys, period_keys, date_keys=()) -> pd.DataFrame:
+    df = pd.DataFrame(rows or [])
+    if df.empty: return pd.DataFrame(columns=COLUMNS)
+    out = pd.DataFrame({
+        "currency": _column(df, ("幣種", "symbol"), DEFAULT_CURRENCY).fillna(DEFAULT_CURRENCY).astype(str),
+        "amount": _numeric(_column(df, amount_keys, 0)).fillna(0.0),
+        "rate": _numeric(_column(df, rate_keys)),
+        "period": _numeric(_column(df, period_keys)),
+        "date": _column(df, date_keys, "未知日期").fillna("未知日期").astype(str),
+    })
+    return out
+
+
+def summarize(df: pd.DataFrame, keys, sort=False) -> pd.DataFrame:
+    """金額加總、金額加權年化、筆數、平均天期。sort=True 時依鍵排序 (類別鍵依類別順序)，否則依首次出現順序。"""
+    if df.empty: return pd.DataFrame(columns=[*keys, "amount", "weighted_apr", "count", "avg_period"])
+    work = df.assign(_rate_amt=df["rate"].fillna(0) * df["amount"], _rated_amt=df["amount"].where(df["rate"].notna(), 0.0))
+    g = work.groupby(keys, sort=sort, observed=True)
+    out = g.agg(amount=("amount", "sum"), _rate_amt=("_rate_amt", "sum"), _rated_amt=("_rated_amt", "sum"),
+                count=("amount", "size"), avg_period=("period", "mean")).reset_index()
+    out["weighted_apr"] = out["_rate_amt"] / out["_rated_amt"].replace(0, np.nan)
+    return out[[*keys, "amount", "weighted_apr", "count", "avg_period"]]
+
+
+def with_bucket(df: pd.DataFrame) -> pd.DataFrame:
+    return df.assign(bucket=pd.cut(df["period"], PERIOD_BINS, labels=PERIOD_LABELS, include_lowest=True))
+
+
+def build_aggregates(payload: dict) -> dict:
+    payload = payload or {}
+    loans = normalize(payload.get("loans"), ("金額",), ("年化 (%)",), ())
+    offers = normalize(payload.get("offers"), ("金額",), ("raw_rate",), ("掛單天期", "天期", "期間"))
+    matches = normalize(payload.get("matched_trades"), ("數量", "金額"), ("利率",), ("期間", "天期"), ("日期",))
+    result = {"matches": matches}
+    for name, df in (("loans", loans), ("offers", offers)):
+        result[f"{name}_count"] = int(len(df))
+        result[f"{name}_by_currency"] = summarize(df, ["currency"])
+    result["offers_by_bucket"] = summarize(with_bucket(offers), ["bucket"], sort=True)
+    result["matches_by_day"] = summarize(matches, ["date", "currency"])
+    # 日期 -> 原始列位置 (依首次出現順序)，供歷史配對清單分組渲染
+    result["match_groups"] = {d: idx.tolist() for d, idx in matches.groupby("date", sort=False).indices.items()} if len(matches) else {}
+    result["matches_by_bucket"] = summarize(with_bucket(matches), ["bucket"], sort=True)
+    return result
+
+
+def currency_amount_lines(by_currency: pd.DataFrame, fmt="{:,.2f}") -> list:
+    """卡片主數字：逐幣種 (金額由大到小) 回傳 [(幣種, 格式化金額)]，不跨幣種加總。"""
+    if by_currency.empty: return []
+    ordered = by_currency.sort_values("amount", ascending=False)
+    return [(c, fmt.format(a)) for c, a in zip(ordered["currency"], ordered["amount"])]
@@ -1,14 +1,25 @@
 import streamlit as st
 import aiohttp
 import asyncio
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import timedelta, datetime
 import logging
 import json
-import collections
+import os
+import re
+import hashlib
+import threading
+import time
+import socket
 from zoneinfo import ZoneInfo
+from snapshot_store import SNAPSHOT_KEY, create_snapshot_store, dumps_snapshot, loads_snapshot
+import data_layer
+import replay
+import aggregation
+from data_layer import auth_json, build_users, fetch_decision_history, fetch_lending_snapshot, fetch_system_cache_row, get_fetch_cache, get_resilience, snapshot_version, summary_json
 
 # ================= 0. 系統與日誌配置 =================
 st.set_page_config(page_title="資金管理終端", layout="wide", initial_sidebar_state="collapsed")
@@ -25,139 +36,115 @@ except Exception:
 # ================= 1. 常數與初始化 =================
 SUPABASE_URL = st.secrets.get("SUPABASE_URL", "")
 SUPABASE_KEY = st.secrets.get("SUPABASE_KEY", "")
+data_layer.configure(SUPABASE_URL, SUPABASE_KEY)
+
+# 共享快照層：local = 各行程自行取數；file / redis = 選出單一輪詢者，其餘行程讀共享快照
+SNAPSHOT_BACKEND = st.secrets.get("SNAPSHOT_BACKEND", "local")
+SNAPSHOT_DIR = st.secrets.get("SNAPSHOT_DIR", "")
+SNAPSHOT_REDIS_URL = st.secrets.get("SNAPSHOT_REDIS_URL", "")
+SNAPSHOT_POLL_SECONDS = int(st.secrets.get("SNAPSHOT_POLL_SECONDS", 30))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
 
 if 'refresh_rate' not in st.session_state: st.session_state.refresh_rate = 300
 if 'last_update' not in st.session_state: st.session_state.last_update = "尚未同步"
 if 'logged_in_user' not in st.session_state: st.session_state.logged_in_user = None
 
-# ================= 2. 視覺風格定義 =================
-st.markdown("""
-<style>
-/* 手機與平版：小螢幕時自動垂直堆疊，不超出邊界 */
-@media (max-width: 768px) {
-    .responsive-grid {
-        display: flex !important;
-        flex-direction: column !important;
-        gap: 16px !important;
-    }
-    .grid-cell {
-        flex: 1 1 100% !important;
-        width: 100% !important;
-    }
+# ================= 2. 視覺風格定義 (靜態資源管線) =================
+# CSS/JS 於啟動時建置一次：最小化 + 內容雜湊檔名，交由 Streamlit 靜態服務 (app/static) 供瀏覽器快取，
+# 每次 rerun 僅送出一行 <link>/<script src> 參照，而非整段樣式與腳本。
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, "static")
+STATIC_URL = "./app/static"
+ASSET_SOURCES = {
+    "base": "assets/base.css",
+    "dashboard": "style.css",
+    "pwa": "assets/pwa.js",
 }
+# 舊雜湊檔保留天數：滾動部署/多工作行程時，舊版頁面仍可能引用舊檔名
+STATIC_RETENTION_DAYS = 7
 
-/* 電腦版：大螢幕時左右並排對比 */
-@media (min-width: 769px) {
-    .responsive-grid {
-        display: flex !important;
-        flex-direction: row !important;
-        justify-content: space-between !important;
-        gap: 16px !important;
-    }
-    .grid-cell {
-        flex: 1 1 49% !important;
-        width: 49% !important;
-    }
-}
+def minify_css(text: str) -> str:
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    return text.replace(';}', '}').strip()
 
-.okx-tooltip { position: relative; cursor: help; border-bottom: 1px dashed #7a808a; }
-.okx-tooltip:hover::after {
-    content: attr(data-tip);
-    position: absolute;
-    bottom: 120%;
-    left: 50%;
-    transform: translateX(-50%);
-    background: rgba(30, 35, 41, 0.95);
-    color: #fff;
-    padding: 8px 12px;
-    border-radius: 6px;
-    font-size: 0.8rem;
-    white-space: pre-wrap;
-    word-wrap: break-word;
-    max-width: 250px;
-    width: max-content;
-    z-index: 9999;
-    border: 1px solid #3b4048;
-    box-shadow: 0 4px 12px rgba(0,0,0,0.5);
-    text-align: left;
-}
-div[data-testid="stHorizontalBlock"]:first-of-type {
-    flex-wrap: nowrap !important;
-    display: flex !important;
-    flex-direction: row !important;
-    align-items: center !important;
-}
-div[data-testid="stHorizontalBlock"]:first-of-type > div[data-testid="column"]:nth-child(1) {
-    flex: 1 1 70% !important;
-    width: 70% !important;
-    min-width: 0 !important;
-}
-div[data-testid="stHorizontalBlock"]:first-of-type > div[data-testid="column"]:nth-child(2) {
-    flex: 1 1 30% !important;
-    width: 30% !important;
-    min-width: 80px !important;
-}
-.strategy-card { background: rgba(255,255,255,0.05); padding: 12px; border-radius: 8px; margin-bottom: 8px; border-left: 3px solid #a855f7; }
-</style>
-""", unsafe_allow_html=True)
+def minify_js(text: str) -> str:
+    # 保守處理：僅去除縮排與空行，保留換行以避免 ASI 問題
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
 
-st.components.v1.html("""<script>
-function forceBlackAndPWA(doc) {
-    if (!doc) return;
-    doc.documentElement.style.background = '#000000';
-    doc.body.style.background = '#000000';
-    
-    const oldMetas = doc.querySelectorAll('meta[name="theme-color"]');
-    oldMetas.forEach(m => m.remove());
-    const metaBlack = doc.createElement('meta');
-    metaBlack.name = 'theme-color';
-    metaBlack.content = '#000000';
-    doc.head.appendChild(metaBlack);
-
-    const viewportMeta = doc.querySelector('meta[name="viewport"]');
-    if (viewportMeta) {
-        viewportMeta.content = 'width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no';
-    } else {
-        const meta = doc.createElement('meta');
-        meta.name = 'viewport';
-        meta.content = 'width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no';
-        doc.head.appendChild(meta);
-    }
-}
-try { forceBlackAndPWA(document); } catch(e) {}
-try { forceBlackAndPWA(window.parent.document); } catch(e) {}
-</script>""", height=0, width=0)
+@st.cache_resource(show_spinner=False)
+def build_static_assets() -> dict:
+    assets = {}
+    for name, rel_path in ASSET_SOURCES.items():
+        try:
+            with open(os.path.join(APP_DIR, rel_path), "r", encoding="utf-8") as f: raw = f.read()
+        except FileNotFoundError:
+            continue
+        ext = rel_path.rsplit(".", 1)[-1]
+        content = minify_css(raw) if ext == "css" else minify_js(raw)
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+        filename = f"{name}.{digest}.{ext}"
+        url = None
+        try:
+            os.makedirs(STATIC_DIR, exist_ok=True)
+            target = os.path.join(STATIC_DIR, filename)
+            if not os.path.exists(target):
+                tmp_path = f"{target}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f: f.write(content)
+                os.replace(tmp_path, target)
+            else:
+                os.utime(target)  # mtime = 最後一次有行程啟用此版本的時間
+            cutoff = time.time() - STATIC_RETENTION_DAYS * 86400
+            for stale in os.listdir(STATIC_DIR):
+                if not (stale.startswith(f"{name}.") and stale.endswith(f".{ext}")) or stale == filename: continue
+                stale_path = os.path.join(STATIC_DIR, stale)
+                try:
+                    if os.path.getmtime(stale_path) < cutoff: os.remove(stale_path)
+                except OSError: pass
+            url = f"{STATIC_URL}/{filename}"
+        except OSError as e:
+            logger.warning(f"靜態資源寫入失敗，改用內嵌模式: {rel_path} ({e})")
+        assets[name] = {"url": url, "content": content}
+    return assets
+
+def inject_css(name: str):
+    asset = build_static_assets().get(name)
+    if not asset: return
+    if asset["url"] and st.get_option("server.enableStaticServing"):
+        st.markdown(f'<link rel="stylesheet" href="{asset["url"]}">', unsafe_allow_html=True)
+    else:
+        st.markdown(f"<style>{asset['content']}</style>", unsafe_allow_html=True)
+
+def inject_script(name: str):
+    asset = build_static_assets().get(name)
+    if not asset: return
+    if asset["url"] and st.get_option("server.enableStaticServing"):
+        st.components.v1.html(f'<script src="{asset["url"]}"></script>', height=0, width=0)
+    else:
+        st.components.v1.html(f"<script>{asset['content']}</script>", height=0, width=0)
+
+inject_css("base")
+inject_script("pwa")
 
 # ================= 3. 資料獲取與設定引擎 =================
-async def fetch_cached_data(session, db_id) -> dict:
-    if not SUPABASE_URL: return {}
-    headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
-    try:
-        async with session.get(f"{SUPABASE_URL}/rest/v1/system_cache?id=eq.{db_id}", headers=headers, timeout=5) as res:
-            if res.status == 200:
-                data = await res.json()
-                if data:
-                    if db_id == 1: st.session_state.last_update = data[0].get('updated_at', '尚未同步')
-                    return data[0].get('payload', {})
-    except Exception: pass
-    return {}
+async def fetch_cached_data(session, db_id, conditional=True) -> dict:
+    row = await fetch_system_cache_row(session, db_id, conditional)
+    if row and db_id == 1: st.session_state.last_update = row.get('updated_at', '尚未同步')
+    return row.get('payload', {}) if row else {}
 
 async def fetch_all_auth_data() -> dict:
-    default_users = {
-        "mingyu": {"pin": "1234", "name": "ming0221", "role": "lending", "db_id": 1}
-    }
-    if not SUPABASE_URL: return default_users
+    if not SUPABASE_URL: return build_users({})
     
     async with aiohttp.ClientSession() as session:
-        r1 = await fetch_cached_data(session, 1)
-        if r1.get('settings', {}).get('pin'): default_users["mingyu"]["pin"] = str(r1['settings']['pin'])
-        return default_users
+        return build_users(await fetch_cached_data(session, 1))
 
 async def update_user_settings(db_id: int, new_settings: dict):
     if not SUPABASE_URL: return False
     headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}", "Content-Type": "application/json", "Prefer": "resolution=merge-duplicates"}
     async with aiohttp.ClientSession() as session:
-        current_payload = await fetch_cached_data(session, db_id)
+        # 讀取-修改-寫回必須取得最新內容，且不可改動共用快取中的物件
+        current_payload = await fetch_cached_data(session, db_id, conditional=False)
         current_settings = current_payload.get('settings', {})
         if not isinstance(current_settings, dict): current_settings = {}
         
@@ -171,35 +158,143 @@ async def update_user_settings(db_id: int, new_settings: dict):
         except Exception: pass
     return False
 
-# [架構更新] 聯合獲取 Bitfinex 與 OKX 的歷史淨值
-async def fetch_history_tables(session) -> tuple:
-    if not SUPABASE_URL: return [], []
-    headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
-    bfx, okx = [], []
-    try:
-        async with session.get(f"{SUPABASE_URL}/rest/v1/bfx_nav?select=record_date,auto_p,hist_p&order=record_date.asc", headers=headers, timeout=5) as res:
-            if res.status == 200: bfx = await res.json()
-        async with session.get(f"{SUPABASE_URL}/rest/v1/okx_portfolio_nav?select=record_date,total_value_usd&order=record_date.asc", headers=headers, timeout=5) as res:
-            if res.status == 200: okx = await res.json()
-    except Exception: pass
-    return bfx, okx
-
-async def fetch_bot_decisions(session) -> list:
-    if not SUPABASE_URL: return []
-    headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
-    try:
-        async with session.get(f"{SUPABASE_URL}/rest/v1/bot_decisions?select=created_at,bot_rate_yearly,market_frr,market_twap,bot_amount,bot_period&order=created_at.desc&limit=300", headers=headers, timeout=5) as res:
-            if res.status == 200: return await res.json()
-    except Exception: pass
-    return []
+# ----------------- 共享快照：輪詢者選舉與讀取 -----------------
+POLLER_LEASE = "lending-poller"
+COLD_START_WAIT = 10.0  # 冷啟動等待本行程輪詢者首輪結果的上限 (秒)，略大於各端點延遲預算
 
-async def fetch_all_data_lending():
-    async with aiohttp.ClientSession() as session:
-        return await asyncio.gather(
-            fetch_cached_data(session, 1), 
-            fetch_history_tables(session), 
-            fetch_bot_decisions(session)
-        )
+@st.cache_resource(show_spinner=False)
+def get_snapshot_store():
+    return create_snapshot_store(SNAPSHOT_BACKEND, SNAPSHOT_DIR, SNAPSHOT_REDIS_URL)
+
+@st.cache_resource(show_spinner=False)
+def get_snapshot_memo() -> dict:
+    # 同一行程內所有 session 共用一份反序列化結果，版本未變不重讀大塊資料
+    return {"lock": threading.Lock(), "version": None, "snapshot": None}
+
+def poll_snapshot_once(store) -> bool:
+    if not store.acquire_lease(POLLER_LEASE, WORKER_ID, SNAPSHOT_POLL_SECONDS * 3): return False
+    snapshot = asyncio.run(fetch_lending_snapshot())
+    if snapshot["data"]:
+        store.set(SNAPSHOT_KEY, dumps_snapshot(snapshot))
+        store.set(f"{SNAPSHOT_KEY}:summary", summary_json(snapshot))
+        store.set(f"{SNAPSHOT_KEY}:auth", auth_json(snapshot))
+        store.set(f"{SNAPSHOT_KEY}:version", str(snapshot["fetched_at"]).encode())
+    return True
+
+@st.cache_resource(show_spinner=False)
+def start_snapshot_poller():
+    # 每個行程只有這條執行緒會寫入共享快照 (同行程的 session 共用 WORKER_ID，不能各自輪詢)
+    store = get_snapshot_store()
+    if store is None: return None
+    first_poll = threading.Event()
+
+    def poll_loop():
+        while True:
+            try: poll_snapshot_once(store)
+            except Exception as e: logger.warning(f"快照輪詢失敗: {e}")
+            first_poll.set()
+            time.sleep(SNAPSHOT_POLL_SECONDS)
+
+    thread = threading.Thread(target=poll_loop, name="snapshot-poller", daemon=True)
+    thread.start()
+    return {"thread": thread, "first_poll": first_poll}
+
+def read_shared_snapshot(store):
+    memo = get_snapshot_memo()
+    version = store.get(f"{SNAPSHOT_KEY}:version")
+    if version is None: return memo["snapshot"]
+    with memo["lock"]:
+        if version != memo["version"]:
+            try:
+                snapshot = loads_snapshot(store.get(SNAPSHOT_KEY))
+            except ValueError as e:
+                logger.warning(f"共享快照解碼失敗，沿用記憶體中的上一版: {e}")
+                return memo["snapshot"]
+            if snapshot is None: return memo["snapshot"]
+            memo["version"], memo["snapshot"] = version, snapshot
+        return memo["snapshot"]
+
+def load_lending_snapshot() -> dict:
+    store = get_snapshot_store()
+    if store is None: return asyncio.run(fetch_lending_snapshot())
+    poller = start_snapshot_poller()
+    snapshot = read_shared_snapshot(store)
+    if snapshot is None:
+        # 冷啟動：等本行程輪詢者跑完首輪 (它若搶得租約就會寫入)，仍無快照才直接取數，且不寫回共享層
+        poller["first_poll"].wait(COLD_START_WAIT)
+        snapshot = read_shared_snapshot(store)
+        if snapshot is None: snapshot = asyncio.run(fetch_lending_snapshot())
+    return snapshot
+
+def load_auth_users() -> dict:
+    store = get_snapshot_store()
+    snapshot = read_shared_snapshot(store) if store else None
+    if snapshot: return build_users(snapshot["data"])
+    return asyncio.run(fetch_all_auth_data())
+
+# ----------------- 以快照版本為鍵的衍生計算 -----------------
+# version 為 snapshot_version() (或再加上參數) 組成的鍵，底線參數不參與 Streamlit 的雜湊計算。
+# 一律用 cache_resource：不做序列化複本，所有 session 共用同一份結果，呼叫端只讀不改。
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_decision_history(version) -> list:
+    history = asyncio.run(fetch_decision_history())
+    # 例外不會被快取：抓取失敗時呼叫端改用面板的近期決策，下次刷新再重試
+    if history is None: raise RuntimeError("決策歷史抓取失敗")
+    return history
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_replay_market(version, _bot_decisions, _matched_trades, _nav_hist, fallback_capital):
+    # 決策與成交對齊成 NumPy 陣列，掃描各組參數時重複使用，不必每次重新解析 DataFrame
+    return replay.prepare_market(_bot_decisions, _matched_trades, _nav_hist, fallback_capital)
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def run_replay_sweep(version, _market, rules=replay.RULES, offsets=tuple(replay.DEFAULT_OFFSETS), ladders=replay.DEFAULT_LADDERS):
+    # 鍵另含掃描參數；結果只有數百列，保留較多組讓不同 session 的常用設定都能命中
+    return replay.sweep(_market, rules, np.asarray(offsets), ladders)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_aggregates(version, _payload) -> dict:
+    # 整份 payload 的 groupby 彙總，只在 payload 變動時重算；各分頁直接取用其中的表
+    return aggregation.build_aggregates(_payload)
+
+def currency_amounts_html(by_currency: pd.DataFrame, fmt: str, font_size: str) -> str:
+    # 各幣種分行列出金額，不混算成單一 $ 總額
+    lines = aggregation.currency_amount_lines(by_currency, fmt) or [("", "0")]
+    return "".join(
+        f'<div class="okx-value-mono" style="font-size:{font_size}; color:#fff;">{amt} <span style="font-size:0.75rem; color:#7a808a; font-family:\'Inter\';">{ccy}</span></div>'
+        for ccy, amt in lines
+    )
+
+def breakdown_table(agg: dict, key: str, key_label: str, sources) -> pd.DataFrame:
+    # 將多個來源 (放貸/掛單/成交) 的同一維度彙總並排成一張表
+    labels = {"loans": "放貸", "offers": "掛單", "matches": "成交"}
+    table = None
+    for src in sources:
+        part = agg[f"{src}_by_{key}"].rename(columns={
+            "amount": f"{labels[src]}金額", "weighted_apr": f"{labels[src]}加權年化 %",
+            "count": f"{labels[src]}筆數", "avg_period": f"{labels[src]}平均天期",
+        })
+        if key == "currency": part = part.drop(columns=[f"{labels[src]}平均天期"])
+        if key == "bucket": part = part.assign(bucket=part["bucket"].astype(str))
+        table = part if table is None else table.merge(part, on=key, how="outer")
+    if key == "bucket":
+        # 外部合併會打亂順序，依天期區間的定義順序重排
+        order = {label: i for i, label in enumerate(aggregation.PERIOD_LABELS)}
+        table = table.sort_values(key, key=lambda s: s.map(order)).reset_index(drop=True)
+    return table.rename(columns={key: key_label}).round(2)
+
+def format_bytes(num) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(num) < 1024: return f"{num:,.0f} {unit}" if unit == "B" else f"{num:,.1f} {unit}"
+        num /= 1024
+    return f"{num:,.1f} GB"
+
+def backend_health(status=None) -> tuple:
+    # 區分「後端慢/斷線」與「真的沒有資料」：熔斷開啟 > 使用舊快照/半開試探 > 正常
+    if status is None: status = get_resilience().status()
+    if any(s["state"] == "open" for s in status.values()): return "降級 (快照)", "#ff4d4f", status
+    if any(s["state"] == "half_open" or s["served"] == "stale" for s in status.values()): return "延遲", "#fcd535", status
+    return "Live", "#b2ff22", status
 
 def format_time_smart(seconds):
     if not seconds or seconds >= 9999999: return "--"
@@ -233,7 +328,8 @@ if not SUPABASE_URL:
     st.error("系統配置錯誤：缺少 SUPABASE_URL")
     st.stop()
 
-USERS = asyncio.run(fetch_all_auth_data())
+# 帳號清單 (含 PIN) 只在登入前需要；已登入的重跑只用到名稱 / 角色 / db_id，不必每次再向上游取 system_cache
+USERS = load_auth_users() if st.session_state.logged_in_user is None else build_users({})
 
 query_user = st.query_params.get("user")
 query_pin = st.query_params.get("pin")
@@ -264,10 +360,7 @@ if st.session_state.logged_in_user is None:
     st.stop()
 
 # ================= 5. 載入面板專屬 CSS =================
-try:
-    with open("style.css", "r", encoding="utf-8") as f: 
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-except FileNotFoundError: pass
+inject_css("dashboard")
 
 user_info = USERS[st.session_state.logged_in_user]
 
@@ -309,12 +402,23 @@ with c_btn:
 @st.fragment(run_every=timedelta(seconds=st.session_state.refresh_rate) if st.session_state.refresh_rate > 0 else None)
 def lending_dashboard_fragment():
     # [架構更新] 解包後端傳來的歷史紀錄 (bfx_hist 與 okx_hist)
-    res = asyncio.run(fetch_all_data_lending())
-    data = res[0]
-    bfx_hist, okx_hist = res[1]
-    bot_decisions = res[2]
+    snapshot = load_lending_snapshot()
+    data = snapshot["data"]
+    bfx_hist, okx_hist = snapshot["bfx_hist"], snapshot["okx_hist"]
+    bot_decisions = snapshot["bot_decisions"]
+    if snapshot.get("updated_at"): st.session_state.last_update = snapshot["updated_at"]
     
-    if not data: return
+    health_label, health_color, health_status = backend_health(snapshot.get("health"))
+    if not data:
+        cache_state = health_status.get("system_cache", {})
+        if cache_state.get("state") == "open":
+            msg = f"後端連線異常，熔斷保護中，約 {cache_state['retry_in']:.0f} 秒後重試..."
+        elif cache_state.get("failures"):
+            msg = "後端回應逾時，重試中..."
+        else:
+            msg = "等待資料同步..."
+        st.markdown(f"<div class='okx-panel' style='text-align:center; color:#7a808a; padding: 40px;'>{msg}</div>", unsafe_allow_html=True)
+        return
         
     tw_full_time = get_taiwan_time(st.session_state.last_update)
     tw_short_time = tw_full_time.split(' ')[1] if ' ' in tw_full_time else ""
@@ -329,7 +433,8 @@ def lending_dashboard_fragment():
 
     cex_apr = data.get("active_apr", 0)
     loans_data = data.get('loans', [])
-    total_loan_amt = sum(l.get('金額', 0) for l in loans_data)
+    data_version = snapshot_version(snapshot)
+    agg = get_aggregates(data_version, data)
     
     # 本金計算
     c_dep = data.get("cum_deposits", 0)
@@ -344,8 +449,8 @@ def lending_dashboard_fragment():
 <div style="font-size: 0.85rem; color: #7a808a; font-family: 'Inter'; margin-top: 4px;">≈ {global_twd:,} TWD</div>
 </div>
 <div style="text-align: right; display: flex; flex-direction: column; align-items: flex-end; gap: 8px;">
-<div style="color:#b2ff22; font-size:0.75rem; font-weight:600; display:flex; align-items:center; justify-content: flex-end;">
-<span style="display:inline-block; width:6px; height:6px; background-color:#b2ff22; border-radius:50%; margin-right:4px;"></span>Live {tw_short_time}
+<div style="color:{health_color}; font-size:0.75rem; font-weight:600; display:flex; align-items:center; justify-content: flex-end;">
+<span style="display:inline-block; width:6px; height:6px; background-color:{health_color}; border-radius:50%; margin-right:4px;"></span>{health_label} {tw_short_time}
 </div>
 <div style="display: flex; gap: 16px;">
 <div style="text-align: right;"><div style="color:#7a808a; font-size:0.75rem;">CEX 投入本金</div><div class="okx-value-mono" style="color:#fff; font-size:1rem;">${c_dep:,.0f}</div></div>
@@ -412,11 +517,11 @@ def lending_dashboard_fragment():
 <div style="display:flex; justify-content:space-between; margin-top:12px;">
 <div>
 <div class="okx-label">鎖定資金</div>
-<div class="okx-value-mono" style="font-size:1.1rem; color:#fff;">${total_loan_amt:,.2f}</div>
+{currency_amounts_html(agg["loans_by_currency"], "{:,.2f}", "1.1rem")}
 </div>
 <div style="text-align:right;">
 <div class="okx-label">合約筆數</div>
-<div class="okx-value-mono" style="font-size:1.1rem; color:#fff;">{len(loans_data)} 筆</div>
+<div class="okx-value-mono" style="font-size:1.1rem; color:#fff;">{agg["loans_count"]} 筆</div>
 </div>
 </div>
 </div>
@@ -509,7 +614,7 @@ def lending_dashboard_fragment():
             st.markdown("<div class='okx-panel-outline' style='text-align:center; color:#7a808a;'>歷史數據不足</div>", unsafe_allow_html=True)
 
     with tab_manage:
-        manage_view = st.selectbox("維度切換", ["放貸合約", "排隊中", "歷史配對"], label_visibility="collapsed")
+        manage_view = st.selectbox("維度切換", ["放貸合約", "排隊中", "歷史配對", "分佈統計"], label_visibility="collapsed")
         
         if manage_view == "放貸合約":
             if not loans_data:
@@ -554,12 +659,11 @@ def lending_dashboard_fragment():
             if not offers_data:
                 st.markdown("<div class='okx-panel' style='text-align:center; color:#7a808a; padding: 40px;'>訂單簿無排隊資料</div>", unsafe_allow_html=True)
             else:
-                total_offer_amt = sum(o.get('金額', 0) for o in offers_data)
                 ai_suggested_target = data.get("prediction_metrics", {}).get("suggested_spike_target", 0.0)
 
                 st.markdown(f"""
 <div style="display: flex; flex-wrap: wrap; gap: 12px; margin-top: 4px; margin-bottom: 16px;">
-<div class="status-card" style="flex: 1 1 45%;"><div class="okx-label">掛單總額</div><div class="okx-value-mono" style="font-size:1.2rem; color:#fff;">${total_offer_amt:,.0f}</div></div>
+<div class="status-card" style="flex: 1 1 45%;"><div class="okx-label">掛單總額</div>{currency_amounts_html(agg["offers_by_currency"], "{:,.0f}", "1.2rem")}</div>
 <div class="status-card" style="flex: 1 1 45%;"><div class="okx-label">掛單數量</div><div class="okx-value-mono" style="font-size:1.2rem; color:#fff;">{len(offers_data)} <span style="font-size:0.8rem; color:#7a808a; font-family:'Inter';">筆</span></div></div>
 </div>
 """, unsafe_allow_html=True)
@@ -600,25 +704,20 @@ def lending_dashboard_fragment():
                 cards_html += "</div>"
                 st.markdown(cards_html, unsafe_allow_html=True)
 
-        else: 
+        elif manage_view == "歷史配對":
             matched_data = data.get('matched_trades', [])
             if not matched_data:
                 st.markdown("<div class='okx-panel' style='text-align:center; color:#7a808a; padding: 40px;'>系統尚未擷取到歷史配對紀錄</div>", unsafe_allow_html=True)
             else:
-                matches_by_date = collections.OrderedDict()
-                for m in matched_data:
-                    date_val = m.get('日期', '未知日期')
-                    if date_val not in matches_by_date: matches_by_date[date_val] = []
-                    matches_by_date[date_val].append(m)
-
                 cards_html = "<div class='list-view-container'>"
-                for date_header, matches_in_date in matches_by_date.items():
+                for date_header, row_idx in agg["match_groups"].items():
                     cards_html += f"""
 <div style='background-color: #0c0e12; border: 1px solid #1a1d24; padding: 8px 12px; border-radius: 6px; margin: 16px 0 8px 0;'>
 <span style='color: #9cdcfe; font-weight: 600; font-size: 0.95rem;'>📅 {date_header}</span>
 </div>
 """
-                    for m in matches_in_date:
+                    for i in row_idx:
+                        m = matched_data[i]
                         display_time = m.get('時間', '尚未同步')
                         rate = str(m.get('利率', ''))
                         period = m.get('期間', '')
@@ -627,6 +726,34 @@ def lending_dashboard_fragment():
                 cards_html += "</div>"
                 st.markdown(cards_html, unsafe_allow_html=True)
 
+        else:
+            if not (agg["loans_count"] or agg["offers_count"] or len(agg["matches"])):
+                st.markdown("<div class='okx-panel' style='text-align:center; color:#7a808a; padding: 40px;'>尚無部位資料可供統計</div>", unsafe_allow_html=True)
+            else:
+                st.markdown("<div style='color:#ffffff; font-weight:600; font-size:1.05rem; margin:10px 0 10px 0;'>幣種曝險</div>", unsafe_allow_html=True)
+                st.dataframe(breakdown_table(agg, "currency", "幣種", ("loans", "offers")), hide_index=True, use_container_width=True)
+
+                st.markdown("<div style='color:#ffffff; font-weight:600; font-size:1.05rem; margin:16px 0 10px 0;'>天期分佈</div>", unsafe_allow_html=True)
+                st.dataframe(breakdown_table(agg, "bucket", "天期", ("offers", "matches")), hide_index=True, use_container_width=True)
+
+                by_day = agg["matches_by_day"]
+                if not by_day.empty:
+                    st.markdown("<div style='color:#ffffff; font-weight:600; font-size:1.05rem; margin:16px 0 10px 0;'>每日成交量</div>", unsafe_allow_html=True)
+                    fig_day = go.Figure()
+                    for ccy, sub in by_day.groupby("currency", sort=False):
+                        fig_day.add_trace(go.Bar(x=sub["date"], y=sub["amount"], name=ccy, customdata=sub[["weighted_apr", "count"]], hovertemplate="%{x}<br>$%{y:,.0f}<br>加權年化 %{customdata[0]:.2f}%<br>%{customdata[1]} 筆"))
+                    fig_day.update_layout(
+                        barmode="stack",
+                        plot_bgcolor='#0c0e12', 
+                        paper_bgcolor='#0c0e12', 
+                        font_color='#7a808a', 
+                        margin=dict(l=0, r=0, t=10, b=0), 
+                        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+                        xaxis=dict(showgrid=False, type="category", autorange="reversed"),
+                        yaxis=dict(showgrid=True, gridcolor='#1a1d24')
+                    )
+                    st.plotly_chart(fig_day, use_container_width=True)
+
     with tab_radar:
         top_bids = data.get('top_bids', [])
         st.markdown("<div style='color:#ffffff; font-weight:600; font-size:1.05rem; margin:10px 0 12px 0;'>買方深度需求</div>", unsafe_allow_html=True)
@@ -789,10 +916,77 @@ def lending_dashboard_fragment():
 </div>
 """, unsafe_allow_html=True)
             
+        st.markdown("<div style='color:#ffffff; font-weight:600; font-size:1.05rem; margin:24px 0 12px 0;'>掛單定價規則回測 (Replay)</div>", unsafe_allow_html=True)
+        try:
+            replay_decisions = get_decision_history(data_version)
+        except RuntimeError:
+            replay_decisions = bot_decisions
+        # 鍵帶上筆數：同一快照版本下，退回近期決策的結果不會與完整歷史混用
+        replay_key = (data_version, len(replay_decisions))
+        replay_market = get_replay_market(replay_key, replay_decisions, data.get('matched_trades', []), bfx_hist, bfx_total)
+        if replay_market is None:
+            st.markdown("<div class='okx-panel' style='text-align:center; color:#7a808a; padding: 40px;'>決策紀錄不足，無法回放...</div>", unsafe_allow_html=True)
+        else:
+            rc1, rc2, rc3 = st.columns([2, 1, 2])
+            offset_range = rc1.slider("偏移掃描範圍 (%)", -3.0, 8.0, (-2.0, 5.0), 0.5)
+            offset_step = rc2.selectbox("偏移間距 (%)", [0.05, 0.1, 0.25], index=0)
+            ladders = rc3.multiselect("梯形網格 (層數 / 層距)", replay.LADDER_CHOICES, default=list(replay.DEFAULT_LADDERS),
+                                      format_func=lambda x: "單一報價" if x[0] == 1 else f"{x[0]} 層 / {x[1]:.2f}%")
+            max_idle = st.slider("可接受閒置率上限 (%)", 0, 100, 100, 5)
+            sweep_df = run_replay_sweep(replay_key, replay_market, offsets=replay.offset_grid(*offset_range, offset_step), ladders=tuple(sorted(ladders)) or ((1, 0.0),))
+            actual = sweep_df[sweep_df["rule"] == "ACTUAL"].iloc[0]
+            candidates = sweep_df[(sweep_df["rule"] != "ACTUAL") & (sweep_df["idle_pct"] <= max_idle)].sort_values("yield_apr", ascending=False)
+            if candidates.empty:
+                st.markdown("<div class='okx-panel' style='text-align:center; color:#7a808a; padding: 40px;'>沒有規則能滿足此閒置率上限</div>", unsafe_allow_html=True)
+            else:
+                best = candidates.iloc[0]
+                ladder_text = f" · {int(best['levels'])} 層 / 間距 {best['step']:.1f}%" if best["levels"] > 1 else ""
+                uplift = best["yield_apr"] - actual["yield_apr"]
+                st.markdown(f"""
+<div class="okx-panel" style="padding:16px; margin-bottom:16px; border-left: 4px solid #a855f7;">
+<div style="color: #ffffff; font-weight: 600; font-size: 1.05rem; margin-bottom: 12px;">最佳規則：{best['rule']} {'+' if best['offset'] >= 0 else ''}{best['offset']:.2f}%{ladder_text}</div>
+<div style="display: flex; flex-wrap: wrap; gap: 24px;">
+<div><div class="okx-label">回放年化</div><div class="okx-value-mono text-green" style="font-size:1.4rem;">{best['yield_apr']:.2f}%</div></div>
+<div><div class="okx-label">成交率</div><div class="okx-value-mono" style="font-size:1.4rem; color:#fff;">{best['fill_rate']:.1f}%</div></div>
+<div><div class="okx-label">閒置率</div><div class="okx-value-mono" style="font-size:1.4rem; color:#fff;">{best['idle_pct']:.1f}%</div></div>
+<div><div class="okx-label okx-tooltip" data-tip="相同回放模型下，實際機器人報價的年化">對照實際 <i>i</i></div><div class="okx-value-mono {'text-green' if uplift >= 0 else 'text-red'}" style="font-size:1.4rem;">{'+' if uplift >= 0 else ''}{uplift:.2f}%</div></div>
+</div>
+<div style="margin-top: 12px; font-size: 0.8rem; color: #7a808a;">* 回放 {len(replay_market)} 個決策視窗 (其中 {replay_market.matched_windows} 個有自身成交)，共掃描 {len(sweep_df) - 1} 組參數。成交門檻取視窗實現 TWAP 與自身最高成交的較高者，未模擬掛單簿深度，結果偏樂觀。</div>
+</div>
+""", unsafe_allow_html=True)
+
+                fig_rp = go.Figure()
+                for rule_name, color in (("FRR", "#fcd535"), ("TWAP", "#b2ff22")):
+                    sub = sweep_df[sweep_df["rule"] == rule_name]
+                    fig_rp.add_trace(go.Scatter(x=sub["idle_pct"], y=sub["yield_apr"], mode="markers", name=rule_name, marker=dict(color=color, size=5, opacity=0.6)))
+                fig_rp.add_trace(go.Scatter(x=[actual["idle_pct"]], y=[actual["yield_apr"]], mode="markers", name="實際", marker=dict(color="#ff4d4f", size=12, symbol="x")))
+                fig_rp.update_layout(
+                    plot_bgcolor='#0c0e12', 
+                    paper_bgcolor='#0c0e12', 
+                    font_color='#7a808a', 
+                    margin=dict(l=0, r=0, t=10, b=0), 
+                    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+                    xaxis=dict(title="閒置率 (%)", showgrid=False),
+                    yaxis=dict(title="回放年化 (%)", showgrid=True, gridcolor='#1a1d24')
+                )
+                st.plotly_chart(fig_rp, use_container_width=True)
+
+                top_df = candidates.head(10)[["rule", "offset", "levels", "step", "yield_apr", "fill_rate", "idle_pct", "est_profit"]]
+                st.dataframe(top_df.rename(columns={"rule": "規則", "offset": "偏移 %", "levels": "層數", "step": "層距 %", "yield_apr": "年化 %", "fill_rate": "成交率 %", "idle_pct": "閒置 %", "est_profit": "估計收益 $"}).round(2), hide_index=True, use_container_width=True)
+
         st.markdown("<hr style='border-color: #2b3139; margin: 24px 0;'>", unsafe_allow_html=True)
 
         with st.expander("系統側錄與終端機日誌 (System Logs)"):
             counts = data.get("sample_counts", {"decisions": 0, "spikes": 0})
+            net = get_fetch_cache().snapshot()
+            state_text = {"closed": ("正常", "#b2ff22"), "half_open": ("試探中", "#fcd535"), "open": ("熔斷", "#ff4d4f")}
+            endpoint_rows = ""
+            for name, s in health_status.items():
+                label, color = state_text.get(s["state"], (s["state"], "#7a808a"))
+                latency = f"{s['last_latency'] * 1000:.0f} ms" if s["last_latency"] is not None else "--"
+                extra = f" · {s['retry_in']:.0f}s 後重試" if s["state"] == "open" else ""
+                served = " · 顯示快照" if s["served"] == "stale" else ""
+                endpoint_rows += f"<div class='okx-list-item border-bottom'><span class='okx-list-label'>{name}</span><span class='okx-value-mono' style='font-size:0.85rem; color:{color};'>{label} · {latency}{extra}{served}</span></div>"
             st.markdown(f"""
 <div style="display:flex; justify-content:space-between; margin-bottom: 12px; border-bottom: 1px solid #2b3139; padding-bottom: 8px;">
 <div style="color:#7a808a; font-size:0.9rem;">資料庫採集進度</div>
@@ -807,6 +1001,27 @@ def lending_dashboard_fragment():
 <div class="okx-value-mono" style="color:#fff; font-size:1.2rem;">{counts.get('spikes', 0)} <span style="font-size:0.8rem; color:#7a808a;">筆</span></div>
 </div>
 </div>
+<div style="display:flex; justify-content:space-between; margin-bottom: 12px; border-bottom: 1px solid #2b3139; padding-bottom: 8px;">
+<div style="color:#7a808a; font-size:0.9rem;">資料傳輸統計 (條件式請求)</div>
+</div>
+<div style="display: flex; flex-wrap: wrap; gap: 16px; margin-bottom: 16px;">
+<div>
+<div class="okx-label okx-tooltip" data-tip="完整下載 / 304 未變動 / 探針命中">請求次數 <i>i</i></div>
+<div class="okx-value-mono" style="color:#fff; font-size:1.2rem;">{net['requests']} <span style="font-size:0.8rem; color:#7a808a;">({net['full']} / {net['not_modified']} / {net['probe_hits']})</span></div>
+</div>
+<div>
+<div class="okx-label">實際傳輸量</div>
+<div class="okx-value-mono" style="color:#fff; font-size:1.2rem;">{format_bytes(net['bytes_received'])}</div>
+</div>
+<div>
+<div class="okx-label">節省傳輸量</div>
+<div class="okx-value-mono text-green" style="font-size:1.2rem;">{format_bytes(net['bytes_saved'])}</div>
+</div>
+</div>
+<div style="display:flex; justify-content:space-between; margin-bottom: 4px; border-bottom: 1px solid #2b3139; padding-bottom: 8px;">
+<div style="color:#7a808a; font-size:0.9rem;">後端端點狀態 (熔斷器)</div>
+</div>
+<div style="margin-bottom: 16px;">{endpoint_rows}</div>
 <div style="background:#000; border-radius:6px; padding:12px; border: 1px solid #1a1d24; font-family:'JetBrains Mono', monospace; font-size:0.8rem; color:#b2ff22; overflow-y:auto; max-height:150px;">
 <div>> Quantum Engine V3.0 initialized.</div>
 <div>> Macro features (DVOL, UST Premium) injected.</div>
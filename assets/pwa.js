@@ -0,0 +1,24 @@
+function forceBlackAndPWA(doc) {
+    if (!doc) return;
+    doc.documentElement.style.background = '#000000';
+    doc.body.style.background = '#000000';
+    
+    const oldMetas = doc.querySelectorAll('meta[name="theme-color"]');
+    oldMetas.forEach(m => m.remove());
+    const metaBlack = doc.createElement('meta');
+    metaBlack.name = 'theme-color';
+    metaBlack.content = '#000000';
+    doc.head.appendChild(metaBlack);
+
+    const viewportMeta = doc.querySelector('meta[name="viewport"]');
+    if (viewportMeta) {
+        viewportMeta.content = 'width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no';
+    } else {
+        const meta = doc.createElement('meta');
+        meta.name = 'viewport';
+        meta.content = 'width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no';
+        doc.head.appendChild(meta);
+    }
+}
+try { forceBlackAndPWA(document); } catch(e) {}
+try { forceBlackAndPWA(window.parent.document); } catch(e) {}
@@ -0,0 +1,407 @@
+# ================= 資料層：Supabase 取數 / 條件式快取 / 韌性層 =================
+# 不依賴 Streamlit，app.py、背景輪詢執行緒與 snapshot_api.py sidecar 共用同一套取數與快取。
+# 快取與熔斷器為模組層級單例：同一行程內 (含 Streamlit 的每次 rerun) 只有一份。
+import asyncio
+import collections
+import json
+import logging
+import math
+import random
+import threading
+import time
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_URL = ""
+SUPABASE_KEY = ""
+
+def configure(url: str, key: str):
+    global SUPABASE_URL, SUPABASE_KEY
+    SUPABASE_URL, SUPABASE_KEY = url or "", key or ""
+
+# 條件式請求：優先使用 ETag / Last-Modified (304)，伺服器不支援時改以極小的探針查詢 (最新一筆 + 筆數) 判斷是否變動，
+# 未變動即沿用上次的完整內容。快取與傳輸計數為行程層級，所有 session 共用。
+try:
+    import brotli  # noqa: F401  (aiohttp 偵測到即可解碼 br)
+    ACCEPT_ENCODING = "br, gzip, deflate"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+class ConditionalFetchCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.stats = {"requests": 0, "full": 0, "not_modified": 0, "probe_hits": 0, "bytes_received": 0, "bytes_saved": 0}
+
+    def get(self, url):
+        with self.lock: return self.entries.get(url)
+
+    def put(self, url, entry):
+        with self.lock: self.entries[url] = entry
+
+    def record(self, outcome, received, saved=0):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats[outcome] += 1
+            self.stats["bytes_received"] += received
+            self.stats["bytes_saved"] += max(saved, 0)
+
+    def snapshot(self) -> dict:
+        with self.lock: return dict(self.stats)
+
+_fetch_cache = ConditionalFetchCache()
+
+def get_fetch_cache() -> ConditionalFetchCache:
+    return _fetch_cache
+
+def supabase_headers(extra=None) -> dict:
+    headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}", "Accept-Encoding": ACCEPT_ENCODING}
+    if extra: headers.update(extra)
+    return headers
+
+def wire_size(res, body: bytes) -> int:
+    # Content-Length 為壓縮後的實際傳輸量；分塊傳輸時退回解碼後長度
+    try: return int(res.headers.get("Content-Length", ""))
+    except ValueError: return len(body)
+
+async def fetch_probe_key(session, probe_url):
+    async with session.get(probe_url, headers=supabase_headers({"Prefer": "count=exact"}), timeout=5) as res:
+        if res.status not in (200, 206): return None, 0
+        body = await res.read()
+        return f"{res.headers.get('Content-Range', '')}|{body.decode('utf-8', 'replace')}", wire_size(res, body)
+
+async def fetch_json_conditional(session, url, probe_url=None):
+    cache = get_fetch_cache()
+    entry = cache.get(url)
+    probe_key, probe_bytes = None, 0
+
+    # 探針須先於完整查詢執行：兩者之間若資料變動，下一輪比對必然不同而重抓，不會卡在舊資料。
+    # 尚無快取時沒有可比對的內容，直接發完整查詢；伺服器若不給驗證標頭，下一輪才開始以探針記錄比對基準。
+    if probe_url and entry and not (entry.get("etag") or entry.get("last_modified")):
+        probe_key, probe_bytes = await fetch_probe_key(session, probe_url)
+        if entry and probe_key is not None and probe_key == entry.get("probe_key"):
+            cache.record("probe_hits", probe_bytes, entry["size"] - probe_bytes)
+            return entry["data"]
+
+    extra = {}
+    if entry and entry.get("etag"): extra["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"): extra["If-Modified-Since"] = entry["last_modified"]
+    async with session.get(url, headers=supabase_headers(extra), timeout=5) as res:
+        if res.status == 304 and entry:
+            cache.record("not_modified", probe_bytes, entry["size"] - probe_bytes)
+            return entry["data"]
+        if res.status != 200: return None
+        body = await res.read()
+        size = wire_size(res, body)
+        data = json.loads(body)
+        etag = res.headers.get("ETag")
+        last_modified = res.headers.get("Last-Modified")
+
+    cache.put(url, {"data": data, "size": size, "etag": etag, "last_modified": last_modified, "probe_key": probe_key})
+    cache.record("full", size + probe_bytes)
+    return data
+
+# ----------------- 韌性層：延遲預算 / 對沖請求 / 抖動退避 / 熔斷器 -----------------
+# 每個端點各自一組預算與熔斷器 (行程層級共用)。熔斷開啟時直接回傳最後一次成功的快照，不再讓每個 session 等滿逾時。
+# 只有首次嘗試會對沖，且每個端點同時最多 MAX_HEDGES_IN_FLIGHT 個對沖請求；每次失敗的嘗試都計入熔斷器，
+# 後端劣化時單次呼叫最多 MAX_ATTEMPTS + 1 個請求 (探針另計)，而非每次重試都加倍。
+ENDPOINT_BUDGETS = {"system_cache": 3.0, "bfx_nav": 4.0, "okx_portfolio_nav": 4.0, "bot_decisions": 4.0, "bot_decisions_history": 8.0}
+DEFAULT_BUDGET = 4.0
+MAX_ATTEMPTS = 3
+RETRY_BASE = 0.2
+BREAKER_THRESHOLD = 3
+BREAKER_BASE_COOLDOWN = 5.0
+BREAKER_MAX_COOLDOWN = 120.0
+MAX_HEDGES_IN_FLIGHT = 1
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opens = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.hedges_in_flight = 0
+        self.latencies = collections.deque(maxlen=50)
+        self.last_latency = None
+        self.last_success = None
+        self.last_served = "none"
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "closed": return True
+            if self.state == "open" and time.monotonic() >= self.open_until:
+                self.state = "half_open"
+                self.trial_in_flight = False
+            if self.state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def on_success(self, request_latency, call_latency):
+        # 對沖門檻只看單一請求的耗時；整次呼叫 (含失敗重試與退避) 的耗時僅供顯示
+        with self.lock:
+            self.state, self.failures, self.opens, self.trial_in_flight = "closed", 0, 0, False
+            self.latencies.append(request_latency)
+            self.last_latency = call_latency
+            self.last_success = time.time()
+
+    def on_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == "open": return  # 併發呼叫的遲到失敗不再延長冷卻
+            if self.state == "half_open" or self.failures >= BREAKER_THRESHOLD:
+                self.opens += 1
+                cooldown = min(BREAKER_MAX_COOLDOWN, BREAKER_BASE_COOLDOWN * 2 ** (self.opens - 1))
+                self.open_until = time.monotonic() + cooldown * random.uniform(0.5, 1.0)
+                if self.state != "open": logger.warning(f"熔斷開啟: {self.name} (連續失敗 {self.failures} 次)")
+                self.state = "open"
+
+    @property
+    def is_open(self) -> bool:
+        with self.lock: return self.state == "open"
+
+    def hedge_delay(self, budget) -> float:
+        # 以近期 p90 延遲作為對沖觸發點 (nearest-rank，樣本少時不會低估)，落在 [0.25s, 預算一半] 之間
+        with self.lock: samples = sorted(self.latencies)
+        if len(samples) < 5: return budget * 0.4
+        p90 = samples[math.ceil(len(samples) * 0.9) - 1]
+        return min(max(p90, 0.25), budget * 0.5)
+
+    def try_hedge(self) -> bool:
+        with self.lock:
+            if self.hedges_in_flight >= MAX_HEDGES_IN_FLIGHT: return False
+            self.hedges_in_flight += 1
+            return True
+
+    def hedge_done(self):
+        with self.lock: self.hedges_in_flight = max(0, self.hedges_in_flight - 1)
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "retry_in": max(0.0, self.open_until - time.monotonic()) if self.state == "open" else 0.0,
+                "last_latency": self.last_latency,
+                "last_success": self.last_success,
+                "served": self.last_served,
+            }
+
+class ResilienceRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.breakers = {}
+
+    def breaker(self, name) -> CircuitBreaker:
+        with self.lock:
+            if name not in self.breakers: self.breakers[name] = CircuitBreaker(name)
+            return self.breakers[name]
+
+    def status(self) -> dict:
+        with self.lock: breakers = dict(self.breakers)
+        return {name: b.status() for name, b in breakers.items()}
+
+_resilience = ResilienceRegistry()
+
+def get_resilience() -> ResilienceRegistry:
+    return _resilience
+
+async def timed_fetch(session, url, probe_url):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    data = await fetch_json_conditional(session, url, probe_url)
+    return data, loop.time() - started
+
+async def hedged_fetch(session, url, probe_url, hedge_after, breaker=None):
+    # 首發請求超過 hedge_after 仍未回應時，再發一個重複請求，取先成功者；hedge_after 為 None 時不對沖。
+    # 回傳 (資料, 勝出請求自身的耗時)
+    tasks = {asyncio.ensure_future(timed_fetch(session, url, probe_url))}
+    hedged = False
+    if hedge_after is not None:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done and (breaker is None or breaker.try_hedge()):
+            hedged = breaker is not None
+            tasks.add(asyncio.ensure_future(timed_fetch(session, url, probe_url)))
+    try:
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if not t.cancelled() and t.exception() is None and t.result()[0] is not None:
+                    return t.result()
+        return None, None
+    finally:
+        for t in tasks: t.cancel()
+        if hedged: breaker.hedge_done()
+
+async def fetch_resilient(session, endpoint, url, probe_url=None):
+    breaker = get_resilience().breaker(endpoint)
+    entry = get_fetch_cache().get(url)
+    fallback = entry["data"] if entry else None
+
+    if not breaker.allow():
+        breaker.last_served = "stale" if fallback is not None else "none"
+        return fallback
+
+    budget = ENDPOINT_BUDGETS.get(endpoint, DEFAULT_BUDGET)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + budget
+    for attempt in range(MAX_ATTEMPTS):
+        remaining = deadline - loop.time()
+        if remaining <= 0: break
+        hedge_after = breaker.hedge_delay(budget) if attempt == 0 else None
+        try:
+            data, request_latency = await asyncio.wait_for(hedged_fetch(session, url, probe_url, hedge_after, breaker), timeout=remaining)
+        except Exception:
+            data = None
+        if data is not None:
+            breaker.on_success(request_latency, loop.time() - started)
+            breaker.last_served = "live"
+            return data
+        breaker.on_failure()
+        if breaker.is_open: break
+        # 抖動指數退避 (full jitter)，退避後仍須落在預算內
+        delay = random.uniform(0, RETRY_BASE * 2 ** attempt)
+        if loop.time() + delay >= deadline: break
+        await asyncio.sleep(delay)
+
+    breaker.last_served = "stale" if fallback is not None else "none"
+    return fallback
+
+async def fetch_system_cache_row(session, db_id, conditional=True) -> dict:
+    if not SUPABASE_URL: return {}
+    url = f"{SUPABASE_URL}/rest/v1/system_cache?id=eq.{db_id}"
+    probe_url = f"{SUPABASE_URL}/rest/v1/system_cache?select=updated_at&id=eq.{db_id}"
+    try:
+        if conditional:
+            data = await fetch_resilient(session, "system_cache", url, probe_url)
+        else:
+            async with session.get(url, headers=supabase_headers(), timeout=5) as res:
+                data = await res.json() if res.status == 200 else None
+        if data: return data[0]
+    except Exception: pass
+    return {}
+
+def build_users(r1: dict) -> dict:
+    default_users = {
+        "mingyu": {"pin": "1234", "name": "ming0221", "role": "lending", "db_id": 1}
+    }
+    if (r1 or {}).get('settings', {}).get('pin'): default_users["mingyu"]["pin"] = str(r1['settings']['pin'])
+    return default_users
+
+# [架構更新] 聯合獲取 Bitfinex 與 OKX 的歷史淨值
+async def fetch_history_tables(session) -> tuple:
+    if not SUPABASE_URL: return [], []
+    bfx, okx = [], []
+    try:
+        # 探針：最新一筆完整列 + 總筆數，可同時偵測新增與當日列的就地更新
+        bfx, okx = await asyncio.gather(
+            fetch_resilient(
+                session, "bfx_nav",
+                f"{SUPABASE_URL}/rest/v1/bfx_nav?select=record_date,auto_p,hist_p&order=record_date.asc",
+                f"{SUPABASE_URL}/rest/v1/bfx_nav?select=record_date,auto_p,hist_p&order=record_date.desc&limit=1",
+            ),
+            fetch_resilient(
+                session, "okx_portfolio_nav",
+                f"{SUPABASE_URL}/rest/v1/okx_portfolio_nav?select=record_date,total_value_usd&order=record_date.asc",
+                f"{SUPABASE_URL}/rest/v1/okx_portfolio_nav?select=record_date,total_value_usd&order=record_date.desc&limit=1",
+            ),
+        )
+    except Exception: pass
+    return bfx or [], okx or []
+
+async def fetch_bot_decisions(session) -> list:
+    if not SUPABASE_URL: return []
+    try:
+        return await fetch_resilient(
+            session, "bot_decisions",
+            f"{SUPABASE_URL}/rest/v1/bot_decisions?select=created_at,bot_rate_yearly,market_frr,market_twap,bot_amount,bot_period&order=created_at.desc&limit=300",
+            f"{SUPABASE_URL}/rest/v1/bot_decisions?select=created_at&order=created_at.desc&limit=1",
+        ) or []
+    except Exception: pass
+    return []
+
+DECISION_PAGE_SIZE = 1000  # PostgREST (Supabase 預設 max-rows) 單次回應上限
+
+async def fetch_decision_history():
+    # 回放用的完整決策歷史 (面板的 bot_decisions 只有最新 300 筆，僅供側錄圖表)。
+    # 依 created_at 遞增分頁，新資料只會接在尾端，前面各頁的 offset 穩定；任一頁失敗回傳 None，避免拿殘缺歷史回測。
+    if not SUPABASE_URL: return []
+    rows = []
+    async with aiohttp.ClientSession() as session:
+        while True:
+            page = await fetch_resilient(
+                session, "bot_decisions_history",
+                f"{SUPABASE_URL}/rest/v1/bot_decisions?select=created_at,bot_rate_yearly,market_frr,market_twap,bot_amount,bot_period&order=created_at.asc&limit={DECISION_PAGE_SIZE}&offset={len(rows)}",
+            )
+            if page is None: return None
+            rows.extend(page)
+            if len(page) < DECISION_PAGE_SIZE: return rows
+
+async def fetch_lending_snapshot() -> dict:
+    # 不觸碰 st.session_state，背景輪詢執行緒與 sidecar 皆可呼叫
+    async with aiohttp.ClientSession() as session:
+        row, (bfx_hist, okx_hist), bot_decisions = await asyncio.gather(
+            fetch_system_cache_row(session, 1), 
+            fetch_history_tables(session), 
+            fetch_bot_decisions(session)
+        )
+    return {
+        "data": row.get('payload', {}) if row else {},
+        "updated_at": row.get('updated_at') if row else None,
+        "bfx_hist": bfx_hist,
+        "okx_hist": okx_hist,
+        "bot_decisions": bot_decisions,
+        "fetched_at": time.time(),
+        "health": get_resilience().status(),
+    }
+
+def snapshot_version(snapshot: dict) -> tuple:
+    """快照內容版本，作為下游衍生計算的快取鍵。
+
+    與探針相同的變動偵測：payload 看 system_cache.updated_at，歷史表看筆數 + 最新一筆 (可偵測當日列就地更新)。
+    只看 O(1) 的欄位，不對整份內容做雜湊。
+    """
+    def latest(rows, index):
+        if not rows: return (0, "")
+        return (len(rows), json.dumps(rows[index], sort_keys=True, default=str))
+    return (
+        snapshot.get("updated_at"),
+        latest(snapshot.get("bfx_hist"), -1),
+        latest(snapshot.get("okx_hist"), -1),
+        latest(snapshot.get("bot_decisions"), 0),  # bot_decisions 依 created_at 降冪
+    )
+
+# ----------------- 精簡摘要 (手機小工具 / 警報用) -----------------
+def build_summary(snapshot: dict) -> dict:
+    data = snapshot.get("data") or {}
+    okx_data = data.get("external_assets") or {}
+    pred = data.get("prediction_metrics") or {}
+    return {
+        "global_total": round(data.get("total", 0) + okx_data.get("total_value_usd", 0.0), 2),
+        "active_apr": data.get("active_apr", 0),
+        "idle_pct": data.get("idle_pct", 0),
+        "today_profit": data.get("today_profit", 0),
+        "spike_probability_pct": pred.get("spike_probability_pct", 0.0),
+        "is_sniper_mode_active": pred.get("is_sniper_mode_active", False),
+        "updated_at": snapshot.get("updated_at"),
+    }
+
+def summary_json(snapshot: dict) -> bytes:
+    return json.dumps(build_summary(snapshot), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def auth_pins(snapshot: dict) -> dict:
+    # 只收錄 payload 內實際設定的 PIN；尚未設定時回傳空表，sidecar 不接受內建的預設 PIN
+    data = snapshot.get("data") or {}
+    if not (data.get("settings") or {}).get("pin"): return {}
+    return {name: user["pin"] for name, user in build_users(data).items()}
+
+def auth_json(snapshot: dict) -> bytes:
+    # 與公開摘要分開存放 (:auth 附屬鍵)，sidecar 驗證時不必載入整份快照
+    return json.dumps({"pins": auth_pins(snapshot)}, separators=(",", ":")).encode("utf-8")
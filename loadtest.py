@@ -0,0 +1,334 @@
+# ================= 併發會話壓力測試 =================
+# 以 Streamlit AppTest 在同一行程內啟動 N 個無頭 session (共用 cache_resource，等同單一 app.py 實例)，
+# 對本機模擬 Supabase 登入、依 refresh_rate 執行面板刷新、切換檢視，並隨 N 擴增回報：
+#   CPU 使用率 (app 行程與模擬 Supabase 子行程分開計)、每 session 記憶體增量、整頁重跑延遲分佈 / 排程落後、
+#   登入與刷新各自的上游請求數與流量
+#
+# 用法: python loadtest.py --sessions 1,5,10,20 --duration 60 --speedup 10
+#       python loadtest.py --snapshot-backend redis --redis-url redis://localhost:6379/0
+# 註：AppTest 不會自行觸發 run_every，也沒有只重跑 fragment 的介面，刷新週期由本工具依 refresh_rate / speedup
+#     排程「整頁重跑」模擬；延遲欄位量的是整頁重跑 (含 fragment 外的版面)，實際 fragment 刷新只會更短。
+#     共享快照的輪詢間隔 (SNAPSHOT_POLL_SECONDS) 也同樣依 speedup 縮短。
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+MANAGE_VIEWS = ["放貸合約", "排隊中", "歷史配對", "分佈統計"]
+
+# ================= 1. 模擬 Supabase =================
+def build_fixtures(seed=7, days=365, loans=60, offers=20, matches=200, decisions=300) -> dict:
+    rng = random.Random(seed)
+    today = datetime(2026, 1, 1)
+    payload = {
+        "total": 52000.0, "active_apr": 12.4, "market_twap": 10.8, "idle_pct": 3.2, "today_profit": 17.35, "fx": 32.1,
+        "cum_deposits": 50000, "cum_withdrawals": 2000, "next_payout_total": 8.2, "next_repayment_time": 5400,
+        "external_assets": {"total_value_usd": 8200.0, "holdings": [{"type": "現貨", "symbol": "BTC", "usd_value": 5200.0}],
+                            "strategies": [{"name": "網格 ETH", "apy": 18.2, "amount": 3000.0}]},
+        "loans": [{"金額": round(rng.uniform(150, 3000), 2), "年化 (%)": rng.uniform(8, 25), "幣種": rng.choice(["USD", "USDT"]),
+                   "_sort_sec": rng.randint(0, 30 * 86400)} for _ in range(loans)],
+        "offers": [{"金額": round(rng.uniform(150, 2000), 2), "raw_rate": rng.uniform(8, 30), "掛單天期": f"{rng.choice([2, 7, 30, 120])}天",
+                    "狀態": rng.choice(["排隊", "換倉"]), "排隊時間": f"{rng.randint(0, 40)}h {rng.randint(0, 59)}m"} for _ in range(offers)],
+        "matched_trades": [{"日期": (today - timedelta(days=i // 10)).strftime("%Y-%m-%d"), "時間": f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}",
+                            "利率": f"{rng.uniform(8, 25):.2f}", "期間": rng.choice([2, 7, 30, 120]), "數量": rng.uniform(150, 3000)} for i in range(matches)],
+        "top_bids": [{"rate": rng.uniform(5, 20), "period": rng.choice([2, 30, 120]), "vol": rng.uniform(1e4, 5e5)} for _ in range(10)],
+        "prediction_metrics": {"spike_probability_pct": 42.0, "is_sniper_mode_active": False, "suggested_spike_target": 14.5,
+                               "features": {"obi": 0.3, "btc_momentum": 0.002, "funding_rate": 0.0001, "dvol": 52.0, "ust_premium": 1.0004},
+                               "metrics": {"total_alerts": 40, "hits": 26, "misses": 14, "missed_spikes": 3, "target_error_sum": 12.5}},
+        "sample_counts": {"decisions": decisions, "spikes": 25},
+        "settings": {"pin": "1234"},
+    }
+    dates = [(today - timedelta(days=days - i)).strftime("%Y-%m-%d") for i in range(days)]
+    return {
+        "system_cache": [{"id": 1, "payload": payload, "updated_at": today.isoformat()}],
+        "bfx_nav": [{"record_date": d, "auto_p": 50000 + i * 3.1, "hist_p": i * 4.2} for i, d in enumerate(dates)],
+        "okx_portfolio_nav": [{"record_date": d, "total_value_usd": 8000 + i * 0.6} for i, d in enumerate(dates)],
+        "bot_decisions": [{"created_at": (today - timedelta(hours=i)).isoformat(), "bot_rate_yearly": rng.uniform(9, 13), "market_frr": rng.uniform(9, 11),
+                           "market_twap": rng.uniform(9, 12), "bot_amount": 150, "bot_period": 2} for i in range(decisions)],
+    }
+
+
+class MockSupabase:
+    """在獨立子行程跑的最小 PostgREST 模擬：支援 select / order / limit 與 Prefer: count=exact。
+
+    子行程的 CPU 不會混入 app 行程的量測；計數與子行程 CPU 秒數經由 /__stats 取得。
+    """
+
+    def __init__(self, port=0, latency=0.0):
+        self.port = port
+        self.latency = latency
+        self.tables = build_fixtures()
+        self.requests = collections.Counter()
+        self.bytes_sent = 0
+        self.url = None
+        self.process = None
+
+    # ----- 父行程端 -----
+    def _call(self, method, path) -> dict:
+        req = urllib.request.Request(f"{self.url}{path}", method=method)
+        with urllib.request.urlopen(req, timeout=10) as res: return json.load(res)
+
+    def reset_counters(self):
+        self._call("POST", "/__reset")
+
+    def counters(self) -> dict:
+        return self._call("GET", "/__stats")
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive(): self.process.terminate()
+
+    # ----- 子行程端 -----
+    async def handle_stats(self, request):
+        return web.json_response({"requests": dict(self.requests), "bytes_sent": self.bytes_sent, "cpu_seconds": time.process_time()})
+
+    async def handle_reset(self, request):
+        self.requests.clear()
+        self.bytes_sent = 0
+        return web.json_response({"ok": True})
+
+    async def handle_get(self, request):
+        table = request.match_info["table"]
+        if table not in self.tables: return web.json_response({"message": "not found"}, status=404)
+        if self.latency: await asyncio.sleep(self.latency)
+        rows = self.tables[table]
+        order = request.query.get("order", "")
+        if order.endswith(".desc"): rows = rows[::-1]
+        offset = int(request.query.get("offset", 0))
+        if "limit" in request.query: rows = rows[offset:offset + int(request.query["limit"])]
+        select = request.query.get("select")
+        if select and select != "*":
+            cols = select.split(",")
+            rows = [{c: r.get(c) for c in cols} for r in rows]
+        body = json.dumps(rows, ensure_ascii=False).encode()
+        headers = {"Content-Range": f"0-{max(len(rows) - 1, 0)}/{len(self.tables[table])}"}
+        self.requests[table] += 1
+        self.bytes_sent += len(body)
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+    async def handle_post(self, request):
+        self.requests["post"] += 1
+        return web.Response(status=201)
+
+    def serve(self, conn):
+        loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get("/rest/v1/{table}", self.handle_get)
+        app.router.add_post("/rest/v1/{table}", self.handle_post)
+        app.router.add_get("/__stats", self.handle_stats)
+        app.router.add_post("/__reset", self.handle_reset)
+        runner = web.AppRunner(app, access_log=None)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", self.port)
+        loop.run_until_complete(site.start())
+        conn.send(runner.addresses[0][1])
+        conn.close()
+        loop.run_forever()
+
+    def start(self):
+        # spawn 而非 fork：父行程此時可能已有執行緒 (AppTest / 輪詢者)
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=self.serve, args=(child_conn,), name="mock-supabase", daemon=True)
+        process.start()
+        if not parent_conn.poll(30): raise RuntimeError("模擬 Supabase 啟動逾時")
+        self.port = parent_conn.recv()
+        self.process = process
+        self.url = f"http://127.0.0.1:{self.port}"
+        return self.url
+
+# ================= 2. 會話模擬 =================
+def build_secrets(url, args) -> dict:
+    secrets = {"SUPABASE_URL": url, "SUPABASE_KEY": "loadtest"}
+    if args.snapshot_backend != "local":
+        secrets["SNAPSHOT_BACKEND"] = args.snapshot_backend
+        secrets["SNAPSHOT_POLL_SECONDS"] = max(1, round(args.poll_seconds / args.speedup))
+        if args.snapshot_dir: secrets["SNAPSHOT_DIR"] = args.snapshot_dir
+        if args.redis_url: secrets["SNAPSHOT_REDIS_URL"] = args.redis_url
+    return secrets
+
+
+def install_secrets(secrets: dict, directory: str) -> str:
+    # 不用 at.secrets：AppTest.run 會暫時替換全域 st.secrets 再還原，多執行緒交錯時會互相蓋掉。
+    # 改寫成 secrets.toml 並指定為 Streamlit 的 secrets 來源，所有 session 都從同一份檔案讀取。
+    from streamlit import config
+    path = os.path.join(directory, "secrets.toml")
+    with open(path, "w", encoding="utf-8") as f:
+        for key, value in secrets.items(): f.write(f"{key} = {json.dumps(value)}\n")
+    config.set_option("secrets.files", [path])
+    return path
+
+
+def make_session(url, refresh_rate, args):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(args.app, default_timeout=args.timeout)
+    at.query_params["user"] = args.user
+    at.query_params["pin"] = args.pin
+    at.session_state["refresh_rate"] = refresh_rate
+    return at
+
+
+def run_session(at, refresh_rate, args, deadline, results):
+    rng = random.Random()
+    interval = refresh_rate / args.speedup
+    next_tick = time.monotonic() + rng.uniform(0, interval)  # 錯開起跑時間，避免所有 session 同步
+    while True:
+        now = time.monotonic()
+        if next_tick > deadline: break
+        if next_tick > now: time.sleep(next_tick - now)
+        started = time.monotonic()
+        try:
+            if rng.random() < args.switch_prob:
+                views = [s for s in at.selectbox if s.label == "維度切換"]
+                if views: views[0].select(rng.choice(MANAGE_VIEWS))
+            at.run()
+            ok = not at.exception
+        except Exception:
+            ok = False
+        elapsed = time.monotonic() - started
+        with results["lock"]:
+            results["latencies"].append(elapsed)
+            results["lags"].append(max(0.0, started - next_tick))
+            if not ok: results["errors"] += 1
+        next_tick += interval
+
+# ================= 3. 資源量測 =================
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        if resource is None: return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # 非 Linux 退回峰值 RSS
+
+
+def percentile(values, pct):
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+# ================= 4. 執行與報表 =================
+def run_level(n, url, mock, args) -> dict:
+    rates = args.refresh_rates
+    sessions = [make_session(url, rates[i % len(rates)], args) for i in range(n)]
+    mock.reset_counters()
+    for at in sessions: at.run()  # 登入 (query params) 並完成首輪渲染
+    login = mock.counters()
+    mock.reset_counters()
+    rss_before = rss_bytes()
+    mock_cpu_before = mock.counters()["cpu_seconds"]
+    cpu_before, wall_before = time.process_time(), time.monotonic()
+    results = {"lock": threading.Lock(), "latencies": [], "lags": [], "errors": 0}
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=run_session, args=(at, rates[i % len(rates)], args, deadline, results)) for i, at in enumerate(sessions)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    cpu_used = time.process_time() - cpu_before
+    wall = time.monotonic() - wall_before
+    upstream = mock.counters()
+    lat = results["latencies"]
+    return {
+        "sessions": n,
+        "ticks": len(lat),
+        "errors": results["errors"],
+        "cpu_pct": cpu_used / wall * 100,
+        "mock_cpu_pct": (upstream["cpu_seconds"] - mock_cpu_before) / wall * 100,
+        "rss_mb": rss_bytes() / 2**20,
+        "mem_per_session_kb": max(0, rss_bytes() - args.rss_baseline) / n / 1024,
+        "rss_growth_mb": (rss_bytes() - rss_before) / 2**20,
+        "rerun_p50": percentile(lat, 50), "rerun_p90": percentile(lat, 90), "rerun_p99": percentile(lat, 99),
+        "rerun_max": max(lat, default=0.0), "rerun_mean": statistics.fmean(lat) if lat else 0.0,
+        "lag_p90": percentile(results["lags"], 90),
+        "login_requests": sum(login["requests"].values()),
+        "login_per_table": login["requests"],
+        "upstream_requests": sum(upstream["requests"].values()),
+        "upstream_per_tick": sum(upstream["requests"].values()) / len(lat) if lat else 0.0,
+        "upstream_per_table": upstream["requests"],
+        "upstream_kb": upstream["bytes_sent"] / 1024,
+    }
+
+
+def print_report(rows):
+    # rerun 欄位為整頁重跑耗時；login 為首輪登入的上游請求數，upstream / up/tick 只計登入後的刷新
+    header = (f"{'N':>4} {'ticks':>6} {'err':>4} {'CPU%':>6} {'mock%':>6} {'RSS MB':>8} {'KB/sess':>8} {'rerun p50':>10} {'rerun p90':>10} {'rerun p99':>10} "
+              f"{'lag p90':>8} {'login':>6} {'upstream':>9} {'up/tick':>8} {'up KB':>8}")
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['sessions']:>4} {r['ticks']:>6} {r['errors']:>4} {r['cpu_pct']:>6.1f} {r['mock_cpu_pct']:>6.1f} {r['rss_mb']:>8.1f} {r['mem_per_session_kb']:>8.0f} "
+              f"{r['rerun_p50'] * 1000:>8.0f}ms {r['rerun_p90'] * 1000:>8.0f}ms {r['rerun_p99'] * 1000:>8.0f}ms {r['lag_p90']:>7.2f}s "
+              f"{r['login_requests']:>6} {r['upstream_requests']:>9} {r['upstream_per_tick']:>8.2f} {r['upstream_kb']:>8.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="app.py 併發 session 壓力測試")
+    parser.add_argument("--app", default=APP_PATH)
+    parser.add_argument("--sessions", default="1,5,10,20", help="逗號分隔的併發 session 數")
+    parser.add_argument("--duration", type=float, default=30.0, help="每個併發等級的測試秒數")
+    parser.add_argument("--refresh-rates", default="30,60,120", help="輪流分配給各 session 的 refresh_rate (秒)")
+    parser.add_argument("--speedup", type=float, default=10.0, help="時間加速倍率：實際刷新間隔 = refresh_rate / speedup")
+    parser.add_argument("--switch-prob", type=float, default=0.3, help="每次刷新前切換訂單管理檢視的機率")
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="模擬 Supabase 每個請求的延遲 (秒)")
+    parser.add_argument("--snapshot-backend", default="local", choices=["local", "file", "redis"])
+    parser.add_argument("--snapshot-dir", default="")
+    parser.add_argument("--redis-url", default="", help="SNAPSHOT_BACKEND=redis 時的連線字串")
+    parser.add_argument("--poll-seconds", type=float, default=30.0, help="共享快照輪詢間隔 (未加速前的秒數)，實際 = poll_seconds / speedup")
+    parser.add_argument("--user", default="mingyu")
+    parser.add_argument("--pin", default="1234")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", dest="json_path", default="", help="另存完整結果為 JSON")
+    args = parser.parse_args(argv)
+    args.sessions = [int(x) for x in args.sessions.split(",") if x.strip()]
+    args.refresh_rates = [int(x) for x in args.refresh_rates.split(",") if x.strip() and int(x) > 0]
+    return args
+
+
+def run_all(url, mock, args):
+    with tempfile.TemporaryDirectory(prefix="loadtest-secrets-") as secrets_dir:
+        install_secrets(build_secrets(url, args), secrets_dir)
+        run_levels(url, mock, args)
+
+
+def run_levels(url, mock, args):
+    # 暖機：先在主執行緒完整跑一次，避免多執行緒同時觸發 plotly/orjson 等延遲匯入
+    warmup = make_session(url, args.refresh_rates[0], args)
+    warmup.run()
+    warmup.run()
+    if warmup.exception: raise SystemExit(f"暖機失敗: {warmup.exception}")
+    args.rss_baseline = rss_bytes()
+    print(f"mock supabase: {url} | app: {args.app} | backend: {args.snapshot_backend} | speedup x{args.speedup}")
+    rows = []
+    for n in args.sessions:
+        rows.append(run_level(n, url, mock, args))
+        print(f"N={n} 完成：{rows[-1]['ticks']} 次整頁重跑，p90 {rows[-1]['rerun_p90'] * 1000:.0f} ms")
+    print()
+    print_report(rows)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f: json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mock = MockSupabase(latency=args.upstream_latency)
+    url = mock.start()
+    try: run_all(url, mock, args)
+    finally: mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# ================= 掛單定價回放 / 回測引擎 =================
+# 以歷史 bot_decisions (market_frr / market_twap / bot_rate_yearly) 切出決策視窗，
+# 以「市場可成交上緣」判斷掛單是否成交，對候選定價規則 (FRR+x、TWAP+x、梯形網格) 以 NumPy 廣播一次算完整段歷史：
+#   rates[參數, 視窗, 網格層] = 基準[視窗] + 偏移[參數] + 層距 * 層
+#   成交 = rates <= 視窗成交上緣
+# 成交上緣取市場面資料：視窗結束時 (下一筆決策) 記錄的 market_twap，即該視窗實際成交的時間加權均價；
+# 若自身在視窗內有更高的成交 (matched_trades)，以較高者為準。沒有自身成交的視窗仍有市場門檻，不會被當成全數閒置。
+# 簡化假設：每個視窗重新掛單、成交即賺取該視窗時長的利息 (不模擬多天期鎖倉)；TWAP 以下的掛單視為可成交 (不模擬掛單簿深度)；
+# 利率皆為年化 %；matched_trades 的日期/時間視為台北時間。
+import numpy as np
+import pandas as pd
+
+RULES = ("frr", "twap")
+DEFAULT_OFFSETS = np.round(np.arange(-2.0, 5.0001, 0.05), 4)
+DEFAULT_LADDERS = ((1, 0.0), (3, 0.5), (5, 0.5), (5, 1.0))
+LADDER_CHOICES = ((1, 0.0), (3, 0.25), (3, 0.5), (3, 1.0), (5, 0.25), (5, 0.5), (5, 1.0))
+
+
+def offset_grid(low: float, high: float, step: float) -> tuple:
+    """[low, high] 區間、間距 step 的偏移格點 (含端點)，回傳 tuple 以便作為快取鍵。"""
+    return tuple(np.round(np.arange(low, high + step / 2, step), 4))
+
+
+class ReplayMarket:
+    """回放所需的對齊陣列，長度皆為視窗數 W。"""
+
+    def __init__(self, times, frr, twap, bot_rate, clearing, own_clearing, days, capital):
+        self.times = times
+        self.frr = frr
+        self.twap = twap
+        self.bot_rate = bot_rate
+        self.clearing = clearing
+        self.own_clearing = own_clearing
+        self.days = days
+        self.capital = capital
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def matched_windows(self) -> int:
+        """有自身成交紀錄的視窗數 (僅供顯示，成交判斷以 clearing 為準)。"""
+        return int(np.isfinite(self.own_clearing).sum())
+
+
+def prepare_market(bot_decisions, matched_trades, nav_hist=None, fallback_capital=0.0):
+    dec = pd.DataFrame(bot_decisions or [])
+    if dec.empty or not {"created_at", "market_frr", "market_twap"}.issubset(dec.columns): return None
+    dec["t"] = pd.to_datetime(dec["created_at"], utc=True, errors="coerce")
+    for col in ("market_frr", "market_twap", "bot_rate_yearly"):
+        dec[col] = pd.to_numeric(dec.get(col), errors="coerce")
+    dec = dec.dropna(subset=["t", "market_frr", "market_twap"]).sort_values("t").drop_duplicates("t")
+    if len(dec) < 2: return None
+
+    times = dec["t"].to_numpy(dtype="datetime64[ns]")
+    gaps = np.diff(times).astype("timedelta64[s]").astype(float) / 86400.0
+    days = np.append(gaps, np.median(gaps))  # 最後一個視窗沿用中位數時長
+    window_end = times[-1] + np.timedelta64(int(days[-1] * 86400), "s")
+
+    own_clearing = np.full(len(times), np.nan)
+    matches = pd.DataFrame(matched_trades or [])
+    if not matches.empty and {"日期", "利率"}.issubset(matches.columns):
+        stamp = matches["日期"].astype(str) + " " + matches.get("時間", pd.Series("00:00", index=matches.index)).astype(str)
+        mt = pd.to_datetime(stamp, errors="coerce").dt.tz_localize("Asia/Taipei", ambiguous="NaT", nonexistent="NaT").dt.tz_convert("UTC")
+        rates = pd.to_numeric(matches["利率"].astype(str).str.rstrip("%"), errors="coerce")
+        ok = mt.notna() & rates.notna()
+        mt = mt[ok].to_numpy(dtype="datetime64[ns]")
+        rates = rates[ok].to_numpy(dtype=float)
+        idx = np.searchsorted(times, mt, side="right") - 1
+        inside = (idx >= 0) & (mt < window_end)
+        np.fmax.at(own_clearing, idx[inside], rates[inside])
+
+    # 市場面門檻：視窗 i 的實現 TWAP = 第 i+1 筆決策時記錄的 market_twap (最後一個視窗沿用自身)
+    twap = dec["market_twap"].to_numpy(dtype=float)
+    clearing = np.fmax(np.append(twap[1:], twap[-1]), own_clearing)
+
+    capital = np.full(len(times), float(fallback_capital or 0.0))
+    nav = pd.DataFrame(nav_hist or [])
+    if not nav.empty and "record_date" in nav.columns:
+        nav["d"] = pd.to_datetime(nav["record_date"], utc=True, errors="coerce")
+        nav["cap"] = pd.to_numeric(nav.get("auto_p"), errors="coerce").fillna(0) + pd.to_numeric(nav.get("hist_p"), errors="coerce").fillna(0)
+        nav = nav.dropna(subset=["d"]).sort_values("d")
+        if not nav.empty:
+            pos = np.searchsorted(nav["d"].to_numpy(dtype="datetime64[ns]"), times, side="right") - 1
+            capital = np.where(pos >= 0, nav["cap"].to_numpy()[np.clip(pos, 0, None)], nav["cap"].iloc[0])
+
+    bot_rate = dec["bot_rate_yearly"].to_numpy(dtype=float)
+    return ReplayMarket(times, dec["market_frr"].to_numpy(dtype=float), twap, bot_rate, clearing, own_clearing, days, capital)
+
+
+def score_rates(market: ReplayMarket, rates: np.ndarray) -> dict:
+    """rates 形狀為 (P, W, L)；回傳每組參數的彙總指標 (長度 P 的陣列)。"""
+    with np.errstate(invalid="ignore"):
+        filled = rates <= market.clearing[None, :, None]
+    fill_frac = filled.mean(axis=2)
+    earned = np.where(filled, rates, 0.0).mean(axis=2)
+    w = market.days[None, :]
+    total_days = market.days.sum()
+    return {
+        "fill_rate": filled.mean(axis=(1, 2)) * 100,
+        "idle_pct": (1 - (fill_frac * w).sum(axis=1) / total_days) * 100,
+        "yield_apr": (earned * w).sum(axis=1) / total_days,
+        "est_profit": (market.capital[None, :] * earned / 100 * w / 365).sum(axis=1),
+        "avg_offer": np.nanmean(rates, axis=(1, 2)),
+    }
+
+
+def simulate_rule(market: ReplayMarket, rule: str, offsets, levels: int = 1, step: float = 0.0) -> pd.DataFrame:
+    base = market.frr if rule == "frr" else market.twap
+    offsets = np.asarray(offsets, dtype=float)
+    ladder = np.arange(levels) * step
+    rates = base[None, :, None] + offsets[:, None, None] + ladder[None, None, :]
+    out = pd.DataFrame(score_rates(market, rates))
+    out.insert(0, "rule", rule.upper())
+    out.insert(1, "offset", offsets)
+    out.insert(2, "levels", levels)
+    out.insert(3, "step", step)
+    return out
+
+
+def simulate_actual(market: ReplayMarket) -> pd.DataFrame:
+    # 實際機器人報價做為對照基準
+    rates = market.bot_rate[None, :, None]
+    out = pd.DataFrame(score_rates(market, rates))
+    for i, (col, val) in enumerate((("rule", "ACTUAL"), ("offset", 0.0), ("levels", 1), ("step", 0.0))):
+        out.insert(i, col, val)
+    return out
+
+
+def sweep(market: ReplayMarket, rules=RULES, offsets=DEFAULT_OFFSETS, ladders=DEFAULT_LADDERS) -> pd.DataFrame:
+    frames = [simulate_rule(market, rule, offsets, levels, step) for rule in rules for levels, step in ladders]
+    frames.append(simulate_actual(market))
+    return pd.concat(frames, ignore_index=True)
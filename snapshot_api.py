@@ -0,0 +1,159 @@
+# ================= 唯讀 JSON 快照端點 (sidecar) =================
+# 手機 / 主畫面小工具只需要首頁幾個關鍵數字，不必載入整個 Streamlit 頁面。
+# 本程序與 app.py 共用 data_layer (取數/條件式快取/熔斷器) 與 snapshot_store：
+#   SNAPSHOT_BACKEND = file / redis : 直接讀取輪詢者寫好的 :summary / :auth 附屬鍵，不對 Supabase 發任何請求，也不載入整份快照
+#   SNAPSHOT_BACKEND = local        : 自行以 data_layer 定期輪詢 system_cache 單列 (摘要與 PIN 都只來自該列)，不抓歷史表
+# 摘要於刷新時預先序列化並計算 ETag，請求路徑只做驗證與回傳位元組；Last-Modified 只在摘要內容改變時前進。
+#
+# 用法: python snapshot_api.py --port 8502
+#   GET /snapshot.json  需 Authorization: Bearer <SNAPSHOT_API_TOKEN>，或與面板相同的 ?user=&pin=
+#                       (PIN 僅在讀到 payload 內設定的 PIN 後才接受，不認內建預設值)
+#   GET /healthz
+# 設定讀取 .streamlit/secrets.toml，同名環境變數優先。預設只綁定 127.0.0.1，對外開放請明確指定 --host 並設定 token。
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+import tomllib
+
+import aiohttp
+from aiohttp import web
+
+import data_layer
+from data_layer import auth_pins, fetch_system_cache_row, summary_json
+from snapshot_store import SNAPSHOT_KEY, create_snapshot_store
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - [API] %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SETTING_KEYS = ("SUPABASE_URL", "SUPABASE_KEY", "SNAPSHOT_BACKEND", "SNAPSHOT_DIR", "SNAPSHOT_REDIS_URL", "SNAPSHOT_POLL_SECONDS", "SNAPSHOT_API_TOKEN")
+
+
+def load_settings(secrets_path: str) -> dict:
+    settings = {}
+    try:
+        with open(secrets_path, "rb") as f: settings.update(tomllib.load(f))
+    except FileNotFoundError:
+        pass
+    for key in SETTING_KEYS:
+        if os.environ.get(key): settings[key] = os.environ[key]
+    return settings
+
+
+class SummaryService:
+    def __init__(self, settings: dict):
+        self.poll_seconds = int(settings.get("SNAPSHOT_POLL_SECONDS", 30))
+        self.token = str(settings.get("SNAPSHOT_API_TOKEN", ""))
+        self.store = create_snapshot_store(settings.get("SNAPSHOT_BACKEND", "local"), settings.get("SNAPSHOT_DIR", ""), settings.get("SNAPSHOT_REDIS_URL", ""))
+        self.body = None
+        self.etag = None
+        self.version = None
+        self.pins = {}
+        self.modified_at = 0.0
+        self.refreshed_at = 0.0
+
+    def _publish(self, body: bytes, pins: dict):
+        self.pins = pins
+        if body != self.body:
+            self.body = body
+            self.etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+            self.modified_at = time.time()
+        self.refreshed_at = time.time()
+
+    def _read_store(self):
+        # 同步後端 (檔案 / redis) 呼叫，放在執行緒池執行
+        version = self.store.get(f"{SNAPSHOT_KEY}:version")
+        if version is None or version == self.version: return None
+        body = self.store.get(f"{SNAPSHOT_KEY}:summary")
+        if not body: return None
+        try:
+            pins = json.loads(self.store.get(f"{SNAPSHOT_KEY}:auth") or b"{}").get("pins") or {}
+        except (ValueError, AttributeError):
+            pins = {}
+        return version, body, pins
+
+    async def refresh(self):
+        if self.store is not None:
+            result = await asyncio.get_running_loop().run_in_executor(None, self._read_store)
+            if result:
+                self.version, body, pins = result
+                self._publish(bytes(body), pins)
+            return
+        async with aiohttp.ClientSession() as session:
+            row = await fetch_system_cache_row(session, 1)
+        snapshot = {"data": row.get("payload") or {}, "updated_at": row.get("updated_at")}
+        if snapshot["data"]: self._publish(summary_json(snapshot), auth_pins(snapshot))
+
+    async def refresh_loop(self):
+        # 共享後端只是讀取本機/Redis，可以比上游輪詢更頻繁地檢查版本
+        interval = min(5, self.poll_seconds) if self.store is not None else self.poll_seconds
+        while True:
+            try: await self.refresh()
+            except Exception as e: logger.warning(f"摘要刷新失敗: {e}")
+            await asyncio.sleep(interval)
+
+    def authorized(self, request) -> bool:
+        if self.token:
+            auth = request.headers.get("Authorization", "")
+            supplied = auth[7:] if auth.startswith("Bearer ") else request.query.get("token", "")
+            # compare_digest 對含非 ASCII 的 str 會拋 TypeError，一律比較 UTF-8 位元組
+            if supplied and hmac.compare_digest(supplied.encode("utf-8"), self.token.encode("utf-8")): return True
+        expected = self.pins.get(request.query.get("user", ""))
+        pin = request.query.get("pin", "")
+        return bool(expected and pin and hmac.compare_digest(pin.encode("utf-8"), str(expected).encode("utf-8")))
+
+
+async def handle_snapshot(request):
+    service = request.app["service"]
+    if not service.authorized(request):
+        return web.json_response({"error": "unauthorized"}, status=401)
+    if service.body is None:
+        return web.json_response({"error": "snapshot not ready"}, status=503, headers={"Retry-After": "5"})
+    headers = {
+        "ETag": service.etag,
+        "Cache-Control": f"private, max-age={service.poll_seconds}",
+        "Last-Modified": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(service.modified_at)),
+    }
+    if request.headers.get("If-None-Match") == service.etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=service.body, content_type="application/json", charset="utf-8", headers=headers)
+
+
+async def handle_health(request):
+    service = request.app["service"]
+    return web.json_response({"ready": service.body is not None, "age": round(time.time() - service.refreshed_at, 1) if service.body else None})
+
+
+def create_app(settings: dict) -> web.Application:
+    data_layer.configure(settings.get("SUPABASE_URL", ""), settings.get("SUPABASE_KEY", ""))
+    app = web.Application()
+    app["service"] = SummaryService(settings)
+
+    async def start_refresh(app):
+        app["refresh_task"] = asyncio.create_task(app["service"].refresh_loop())
+
+    async def stop_refresh(app):
+        app["refresh_task"].cancel()
+
+    app.on_startup.append(start_refresh)
+    app.on_cleanup.append(stop_refresh)
+    app.router.add_get("/snapshot.json", handle_snapshot)
+    app.router.add_get("/healthz", handle_health)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="唯讀 JSON 快照端點")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--secrets", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml"))
+    args = parser.parse_args(argv)
+    web.run_app(create_app(load_settings(args.secrets)), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
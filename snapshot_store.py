@@ -0,0 +1,142 @@
+# ================= 共享快照層 (多工作行程水平擴展) =================
+# 多個 Streamlit 行程掛在負載平衡器後方時，由租約 (lease) 選出唯一輪詢者向 Supabase 取數，
+# 其餘行程只讀取序列化好的快照。後端可插拔：
+#   file  : 單機多行程，快照以原子替換寫入共享目錄，讀取經由 mmap
+#   redis : 跨主機，任何 Redis 相容服務 (需安裝 redis 套件)
+# 快照以 zlib 壓縮的 JSON 存放：共享目錄/Redis 的內容不可信任，不能用 pickle (反序列化即可執行任意程式碼)。
+import abc
+import json
+import os
+import mmap
+import tempfile
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows 無 fcntl，租約改為盡力而為
+    fcntl = None
+
+# 放貸面板快照鍵；另有 :version (版本戳記)、:summary (精簡 JSON) 與 :auth (sidecar 驗證用 PIN) 三個附屬鍵
+SNAPSHOT_KEY = "lending:1"
+
+
+def dumps_snapshot(snapshot: dict) -> bytes:
+    return zlib.compress(json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 3)
+
+
+def loads_snapshot(raw):
+    """解碼快照；內容損毀或格式不符時一律拋出 ValueError。"""
+    if not raw: return None
+    try:
+        snapshot = json.loads(zlib.decompress(raw))
+    except zlib.error as e:
+        raise ValueError(f"快照解壓失敗: {e}") from e
+    if not isinstance(snapshot, dict): raise ValueError("快照格式不符")
+    return snapshot
+
+
+class SnapshotStore(abc.ABC):
+    """快照後端介面：get/set 存取位元組，acquire_lease 用於選舉輪詢者。"""
+
+    @abc.abstractmethod
+    def get(self, key: str):
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: bytes):
+        ...
+
+    @abc.abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """取得或續約租約；租約由他人持有且未過期時回傳 False。"""
+
+
+class FileSnapshotStore(SnapshotStore):
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key.replace(':', '_')}.bin")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0: return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return mm[:]
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        # 先寫暫存檔再 os.replace，讀者永遠只會看到完整的舊版或新版；
+        # 暫存檔名由 mkstemp 產生，同行程多執行緒同時寫入也不會互相覆蓋
+        target = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{os.path.basename(target)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, target)
+        except BaseException:
+            try: os.remove(tmp_path)
+            except OSError: pass
+            raise
+
+    def acquire_lease(self, name, owner, ttl):
+        with open(os.path.join(self.directory, f"{name}.lock"), "a+") as lock_file:
+            if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                lease_path = os.path.join(self.directory, f"{name}.lease")
+                now = time.time()
+                try:
+                    with open(lease_path, "r", encoding="utf-8") as f:
+                        holder, expires = f.read().rsplit("|", 1)
+                    if holder != owner and float(expires) > now: return False
+                except (FileNotFoundError, ValueError):
+                    pass
+                with open(lease_path, "w", encoding="utf-8") as f:
+                    f.write(f"{owner}|{now + ttl}")
+                return True
+            finally:
+                if fcntl: fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class RedisSnapshotStore(SnapshotStore):
+    # 比對持有者後才續約，避免覆寫別人剛取得的租約
+    RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+    def __init__(self, url: str, prefix: str = "bfxui:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("SNAPSHOT_BACKEND=redis 需要安裝 redis 套件 (pip install redis)") from e
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._renew = self.client.register_script(self.RENEW_SCRIPT)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value)
+
+    def acquire_lease(self, name, owner, ttl):
+        key = f"{self.prefix}lease:{name}"
+        ttl_ms = int(ttl * 1000)
+        if self.client.set(key, owner, nx=True, px=ttl_ms): return True
+        return bool(self._renew(keys=[key], args=[owner, ttl_ms]))
+
+
+def create_snapshot_store(backend: str, directory: str = "", redis_url: str = ""):
+    """依設定建立後端；backend 為 local/空值時回傳 None (維持單行程直接取數)。"""
+    backend = (backend or "local").lower()
+    if backend == "local": return None
+    if backend == "file": return FileSnapshotStore(directory or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshots"))
+    if backend == "redis": return RedisSnapshotStore(redis_url or "redis://localhost:6379/0")
+    raise ValueError(f"未知的 SNAPSHOT_BACKEND: {backend}")
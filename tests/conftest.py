@@ -0,0 +1,31 @@
+import contextlib
+import os
+import sys
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+# 專案為扁平模組結構 (無套件)，測試直接匯入根目錄模組
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@contextlib.asynccontextmanager
+async def serve(handler, path="/rows"):
+    """在 127.0.0.1 的隨機埠啟動只有單一 GET 路由的 aiohttp 伺服器，產出 (url, ClientSession)。"""
+    app = web.Application()
+    app.router.add_get(path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    host, port = runner.addresses[0][:2]
+    try:
+        async with aiohttp.ClientSession() as session:
+            yield f"http://{host}:{port}{path}", session
+    finally:
+        await runner.cleanup()
+
+
+@pytest.fixture
+def local_server():
+    return serve
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import aggregation
+
+PAYLOAD = {
+    "loans": [
+        {"金額": 100.0, "年化 (%)": 10.0, "幣種": "USD", "_sort_sec": 3600},
+        {"金額": 300.0, "年化 (%)": 20.0, "幣種": "USD", "_sort_sec": 7200},
+        {"金額": 50.0, "年化 (%)": 12.0, "幣種": "USDT", "_sort_sec": 60},
+    ],
+    "offers": [
+        {"金額": 200.0, "raw_rate": 15.0, "掛單天期": "120天"},
+        {"金額": 100.0, "raw_rate": 9.0, "掛單天期": "2天"},
+        {"金額": 100.0, "raw_rate": None, "掛單天期": "30天"},
+    ],
+    "matched_trades": [
+        {"日期": "2026-01-02", "利率": "14.00", "期間": 30, "數量": 10.0},
+        {"日期": "2026-01-01", "利率": "8.00", "期間": 2, "數量": 30.0},
+        {"日期": "2026-01-02", "利率": "12.00", "期間": 7, "數量": 20.0},
+    ],
+}
+
+
+@pytest.fixture(scope="module")
+def agg():
+    return aggregation.build_aggregates(PAYLOAD)
+
+
+def test_currency_split_and_weighted_apr(agg):
+    by_ccy = agg["loans_by_currency"].set_index("currency")
+    assert by_ccy.loc["USD", "amount"] == 400.0 and by_ccy.loc["USDT", "amount"] == 50.0
+    assert by_ccy.loc["USD", "weighted_apr"] == pytest.approx((100 * 10 + 300 * 20) / 400)
+    assert agg["loans_count"] == 3
+
+
+def test_unrated_rows_excluded_from_weighted_apr(agg):
+    # 無利率的掛單計入金額，但不拉低加權年化
+    row = agg["offers_by_currency"].iloc[0]
+    assert row["amount"] == 400.0
+    assert row["weighted_apr"] == pytest.approx((200 * 15 + 100 * 9) / 300)
+
+
+def test_loans_have_no_bucket_view(agg):
+    assert "loans_by_bucket" not in agg
+
+
+def test_buckets_follow_category_order(agg):
+    # 輸入順序為 120 / 2 / 30 天，輸出須依區間定義排序
+    assert list(agg["offers_by_bucket"]["bucket"].astype(str)) == ["≤2天", "8-30天", "31-120天"]
+    assert list(agg["matches_by_bucket"]["bucket"].astype(str)) == ["≤2天", "3-7天", "8-30天"]
+    assert list(agg["offers_by_bucket"]["avg_period"]) == [2.0, 30.0, 120.0]
+
+
+def test_match_groups_keep_first_seen_order(agg):
+    assert agg["match_groups"] == {"2026-01-02": [0, 2], "2026-01-01": [1]}
+    day = agg["matches_by_day"].set_index("date")
+    assert day.loc["2026-01-02", "amount"] == 30.0
+
+
+def test_empty_payload():
+    agg = aggregation.build_aggregates({})
+    assert agg["loans_count"] == 0 and agg["loans_by_currency"].empty and agg["match_groups"] == {}
+
+
+def test_currency_amount_lines_sorted_by_amount():
+    by_ccy = pd.DataFrame({"currency": ["USD", "USDT"], "amount": [10.0, 2500.5]})
+    assert aggregation.currency_amount_lines(by_ccy) == [("USDT", "2,500.50"), ("USD", "10.00")]
+    assert aggregation.currency_amount_lines(by_ccy.iloc[:0]) == []
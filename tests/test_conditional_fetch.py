@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+
+import data_layer
+
+
+class FakeSupabase:
+    """最小 PostgREST 替身：可切換是否回傳 ETag，並記錄每個請求。"""
+
+    def __init__(self, with_etag):
+        self.with_etag = with_etag
+        self.rows = [{"id": i, "v": i} for i in range(1, 6)]
+        self.calls = []
+
+    def etag(self):
+        return f'"v{self.rows[-1]["v"]}"'
+
+    async def handle(self, request):
+        probe = "limit=1" in request.query_string
+        self.calls.append("probe" if probe else "full")
+        if self.with_etag and request.headers.get("If-None-Match") == self.etag():
+            return web.Response(status=304)
+        rows = self.rows[-1:] if probe else self.rows
+        headers = {"Content-Range": f"0-{len(rows) - 1}/{len(self.rows)}"}
+        if self.with_etag: headers["ETag"] = self.etag()
+        return web.Response(body=json.dumps(rows).encode(), content_type="application/json", headers=headers)
+
+
+@pytest.fixture
+def run_fetches(local_server):
+    async def run(fake, rounds):
+        results = []
+        async with local_server(fake.handle) as (url, session):
+            for mutate in rounds:
+                if mutate: mutate(fake)
+                results.append(await data_layer.fetch_json_conditional(session, url, f"{url}?limit=1"))
+        return results
+
+    return lambda fake, rounds: asyncio.run(run(fake, rounds))
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    cache = data_layer.ConditionalFetchCache()
+    monkeypatch.setattr(data_layer, "_fetch_cache", cache)
+    return cache
+
+
+def append_row(fake):
+    fake.rows = [*fake.rows, {"id": len(fake.rows) + 1, "v": fake.rows[-1]["v"] + 1}]
+
+
+def test_etag_revalidation_returns_cached_body(fresh_cache, run_fetches):
+    fake = FakeSupabase(with_etag=True)
+    first, second = run_fetches(fake, [None, None])
+    assert first == second and len(first) == 5
+    # 首次無快取不打探針；有 ETag 後第二次以 If-None-Match 取得 304
+    assert fake.calls == ["full", "full"]
+    stats = fresh_cache.snapshot()
+    assert stats["full"] == 1 and stats["not_modified"] == 1
+
+
+def test_probe_hit_skips_full_query(fresh_cache, run_fetches):
+    fake = FakeSupabase(with_etag=False)
+    first, second, third = run_fetches(fake, [None, None, None])
+    assert first == second == third
+    # 無驗證標頭時，第二輪探針建立比對基準 (需再抓一次完整內容)，之後探針命中即沿用
+    assert fake.calls == ["full", "probe", "full", "probe"]
+    stats = fresh_cache.snapshot()
+    assert stats["probe_hits"] == 1 and stats["bytes_saved"] > 0
+
+
+def test_probe_change_refetches(fresh_cache, run_fetches):
+    fake = FakeSupabase(with_etag=False)
+    *_, last = run_fetches(fake, [None, None, append_row])
+    assert len(last) == 6
+    assert fake.calls == ["full", "probe", "full", "probe", "full"]
+    assert fresh_cache.snapshot()["full"] == 3
+
+
+def test_snapshot_version_tracks_probe_fields():
+    snapshot = {"updated_at": "t1", "bfx_hist": [{"record_date": "d1", "auto_p": 1.0}], "okx_hist": [], "bot_decisions": [{"created_at": "c2"}, {"created_at": "c1"}]}
+    base = data_layer.snapshot_version(snapshot)
+    assert data_layer.snapshot_version(dict(snapshot, fetched_at=2.0)) == base
+    assert data_layer.snapshot_version(dict(snapshot, updated_at="t2")) != base
+    # 當日列就地更新 (筆數不變) 也要失效
+    assert data_layer.snapshot_version(dict(snapshot, bfx_hist=[{"record_date": "d1", "auto_p": 2.0}])) != base
+    assert data_layer.snapshot_version(dict(snapshot, bot_decisions=[{"created_at": "c3"}, *snapshot["bot_decisions"]])) != base
+
+
+def test_decision_history_pages_until_short_page(monkeypatch, local_server):
+    monkeypatch.setattr(data_layer, "_resilience", data_layer.ResilienceRegistry())
+    monkeypatch.setattr(data_layer, "DECISION_PAGE_SIZE", 4)
+    rows = [{"created_at": f"c{i:02d}"} for i in range(10)]
+    offsets = []
+
+    async def decisions(request):
+        offset, limit = int(request.query["offset"]), int(request.query["limit"])
+        offsets.append(offset)
+        return web.json_response(rows[offset:offset + limit])
+
+    async def run():
+        async with local_server(decisions, "/rest/v1/bot_decisions") as (url, _):
+            data_layer.configure(url.rsplit("/rest/", 1)[0], "k")
+            return await data_layer.fetch_decision_history()
+
+    try:
+        history = asyncio.run(run())
+    finally:
+        data_layer.configure("", "")
+    assert history == rows and offsets == [0, 4, 8]
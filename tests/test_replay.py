@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+import replay
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def decisions(twaps, frr=10.0, bot_rate=11.0):
+    return [{"created_at": (START + timedelta(hours=i)).isoformat(), "market_frr": frr, "market_twap": t, "bot_rate_yearly": bot_rate}
+            for i, t in enumerate(twaps)]
+
+
+def trade_at(hour, rate):
+    # matched_trades 的時間為台北時間 (UTC+8)
+    t = START + timedelta(hours=hour, minutes=30) + timedelta(hours=8)
+    return {"日期": t.strftime("%Y-%m-%d"), "時間": t.strftime("%H:%M"), "利率": f"{rate:.2f}"}
+
+
+def test_prepare_market_requires_two_decisions():
+    assert replay.prepare_market([], []) is None
+    assert replay.prepare_market(decisions([10.0]), []) is None
+
+
+def test_clearing_uses_realized_twap_without_own_fills():
+    market = replay.prepare_market(decisions([10.0, 12.0, 11.0]), [], fallback_capital=1000)
+    assert market.matched_windows == 0
+    # 視窗 i 的門檻 = 第 i+1 筆決策的 market_twap；最後一個視窗沿用自身
+    np.testing.assert_allclose(market.clearing, [12.0, 11.0, 11.0])
+
+
+def test_own_fill_above_twap_raises_threshold():
+    market = replay.prepare_market(decisions([10.0, 10.0, 10.0]), [trade_at(1, 14.0)])
+    assert market.matched_windows == 1
+    np.testing.assert_allclose(market.clearing, [10.0, 14.0, 10.0])
+
+
+def test_offsets_bound_idle_and_fill():
+    market = replay.prepare_market(decisions([10.0] * 6), [], fallback_capital=1000)
+    out = replay.simulate_rule(market, "twap", [-1.0, 5.0])
+    low, high = out.iloc[0], out.iloc[1]
+    assert low["idle_pct"] == pytest.approx(0.0) and low["fill_rate"] == pytest.approx(100.0)
+    assert low["yield_apr"] == pytest.approx(9.0) and low["est_profit"] > 0
+    assert high["idle_pct"] == pytest.approx(100.0) and high["yield_apr"] == 0.0
+
+
+def test_ladder_fills_partially():
+    market = replay.prepare_market(decisions([10.0] * 4), [])
+    out = replay.simulate_rule(market, "twap", [0.0], levels=3, step=0.5)
+    assert out.iloc[0]["fill_rate"] == pytest.approx(100 / 3)
+
+
+def test_sweep_shape_includes_actual():
+    market = replay.prepare_market(decisions([10.0, 11.0, 12.0]), [])
+    offsets = np.array([0.0, 0.5])
+    out = replay.sweep(market, offsets=offsets)
+    assert len(out) == len(replay.RULES) * len(replay.DEFAULT_LADDERS) * len(offsets) + 1
+    actual = out[out["rule"] == "ACTUAL"]
+    assert len(actual) == 1 and actual.iloc[0]["avg_offer"] == pytest.approx(11.0)
+
+
+def test_offset_grid_matches_defaults_and_includes_end():
+    assert np.allclose(replay.offset_grid(-2.0, 5.0, 0.05), replay.DEFAULT_OFFSETS)
+    assert replay.offset_grid(0.0, 1.0, 0.25) == (0.0, 0.25, 0.5, 0.75, 1.0)
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import data_layer
+from data_layer import BREAKER_THRESHOLD, CircuitBreaker
+
+
+@pytest.fixture(autouse=True)
+def fresh_singletons(monkeypatch):
+    monkeypatch.setattr(data_layer, "_fetch_cache", data_layer.ConditionalFetchCache())
+    monkeypatch.setattr(data_layer, "_resilience", data_layer.ResilienceRegistry())
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("t")
+    for _ in range(BREAKER_THRESHOLD - 1):
+        breaker.on_failure()
+        assert breaker.allow()
+    breaker.on_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    assert breaker.status()["retry_in"] > 0
+
+
+def test_breaker_half_open_allows_single_trial():
+    breaker = CircuitBreaker("t")
+    for _ in range(BREAKER_THRESHOLD): breaker.on_failure()
+    breaker.open_until = 0.0  # 冷卻結束
+    assert breaker.allow()
+    assert breaker.state == "half_open" and not breaker.allow()
+    breaker.on_success(0.1, 0.1)
+    assert breaker.state == "closed" and breaker.failures == 0 and breaker.allow()
+
+
+def test_breaker_half_open_failure_reopens_with_longer_cooldown():
+    breaker = CircuitBreaker("t")
+    for _ in range(BREAKER_THRESHOLD): breaker.on_failure()
+    breaker.open_until = 0.0
+    assert breaker.allow()
+    breaker.on_failure()
+    assert breaker.state == "open" and breaker.opens == 2
+
+
+def test_late_failure_does_not_extend_open_cooldown():
+    breaker = CircuitBreaker("t")
+    for _ in range(BREAKER_THRESHOLD): breaker.on_failure()
+    open_until = breaker.open_until
+    breaker.on_failure()
+    assert breaker.open_until == open_until and breaker.opens == 1
+
+
+@pytest.mark.parametrize("samples, expected", [
+    ([0.3, 0.4, 0.5, 0.6, 2.0], 1.5),  # n=5：p90 取最大值 (上限為預算一半)
+    ([0.3] * 9 + [1.0], 0.3),
+    ([0.3] * 8 + [1.0, 1.2], 1.0),
+])
+def test_hedge_delay_uses_nearest_rank_p90(samples, expected):
+    breaker = CircuitBreaker("t")
+    breaker.latencies.extend(samples)
+    assert breaker.hedge_delay(3.0) == pytest.approx(expected)
+
+
+def test_hedges_capped_per_endpoint():
+    breaker = CircuitBreaker("t")
+    assert breaker.try_hedge()
+    assert not breaker.try_hedge()
+    breaker.hedge_done()
+    assert breaker.try_hedge()
+
+
+@pytest.fixture
+def fetch_against(local_server):
+    async def run(handler):
+        async with local_server(handler) as (url, session):
+            return await data_layer.fetch_resilient(session, "system_cache", url)
+
+    return lambda handler: asyncio.run(run(handler))
+
+
+def test_degraded_backend_bounded_requests(monkeypatch, fetch_against):
+    monkeypatch.setitem(data_layer.ENDPOINT_BUDGETS, "system_cache", 1.5)
+    calls = []
+
+    async def slow_error(request):
+        calls.append(request.path)
+        await asyncio.sleep(0.7)
+        return web.Response(status=503)
+
+    assert fetch_against(slow_error) is None
+    # 首次嘗試最多對沖一次，重試不對沖：上限 MAX_ATTEMPTS + 1
+    assert len(calls) <= data_layer.MAX_ATTEMPTS + 1
+    breaker = data_layer.get_resilience().breaker("system_cache")
+    assert breaker.failures >= 1 and breaker.last_served == "none"
+
+
+def test_failed_attempts_open_breaker_and_stop_retrying(fetch_against):
+    calls = []
+
+    async def error(request):
+        calls.append(request.path)
+        return web.Response(status=503)
+
+    fetch_against(error)
+    breaker = data_layer.get_resilience().breaker("system_cache")
+    assert breaker.state == "open"
+    assert len(calls) == BREAKER_THRESHOLD
+
+
+def test_latency_sample_excludes_failed_attempts_and_backoff(fetch_against):
+    calls = []
+
+    async def flaky(request):
+        calls.append(request.path)
+        if len(calls) < BREAKER_THRESHOLD: return web.Response(status=503)
+        return web.json_response([{"id": 1}])
+
+    assert fetch_against(flaky) == [{"id": 1}]
+    breaker = data_layer.get_resilience().breaker("system_cache")
+    # 對沖門檻的樣本只記成功那一次請求；前兩次失敗與退避只反映在整次呼叫耗時
+    assert len(breaker.latencies) == 1
+    assert breaker.latencies[0] < breaker.last_latency
@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+import data_layer
+from data_layer import auth_json, summary_json
+from snapshot_api import SummaryService, handle_snapshot
+from snapshot_store import SNAPSHOT_KEY, FileSnapshotStore
+
+
+def request(path, headers=None):
+    return make_mocked_request("GET", path, headers=headers or {})
+
+
+@pytest.fixture
+def service(tmp_path):
+    return SummaryService({"SNAPSHOT_BACKEND": "file", "SNAPSHOT_DIR": str(tmp_path), "SNAPSHOT_API_TOKEN": "s3cret"})
+
+
+def publish(directory, snapshot, version=b"1"):
+    store = FileSnapshotStore(directory)
+    store.set(f"{SNAPSHOT_KEY}:summary", summary_json(snapshot))
+    store.set(f"{SNAPSHOT_KEY}:auth", auth_json(snapshot))
+    store.set(f"{SNAPSHOT_KEY}:version", version)
+
+
+def test_token_auth_handles_non_ascii(service):
+    assert service.authorized(request("/snapshot.json", {"Authorization": "Bearer s3cret"}))
+    assert not service.authorized(request("/snapshot.json?token=密碼"))
+    assert not service.authorized(request("/snapshot.json?user=mingyu&pin=密碼"))
+
+
+def test_default_pin_refused_before_real_pin_loaded(service, tmp_path):
+    assert not service.authorized(request("/snapshot.json?user=mingyu&pin=1234"))
+    publish(str(tmp_path), {"data": {"total": 1.0}})  # payload 未設定 PIN
+    asyncio.run(service.refresh())
+    assert service.body is not None
+    assert not service.authorized(request("/snapshot.json?user=mingyu&pin=1234"))
+
+
+def test_refresh_reads_side_keys_only(service, tmp_path):
+    publish(str(tmp_path), {"data": {"total": 10.0, "settings": {"pin": "9876"}}, "updated_at": "t1"})
+    asyncio.run(service.refresh())
+    assert json.loads(service.body)["global_total"] == 10.0
+    assert "9876" not in service.body.decode()
+    assert service.authorized(request("/snapshot.json?user=mingyu&pin=9876"))
+    assert not service.authorized(request("/snapshot.json?user=mingyu&pin=1234"))
+    etag = service.etag
+    publish(str(tmp_path), {"data": {"total": 10.0, "settings": {"pin": "9876"}}, "updated_at": "t1"}, version=b"2")
+    asyncio.run(service.refresh())
+    assert service.etag == etag  # 內容未變，ETag 不變
+
+
+def test_last_modified_only_advances_on_change(service, tmp_path):
+    app = web.Application()
+    app["service"] = service
+
+    def last_modified():
+        response = asyncio.run(handle_snapshot(make_mocked_request("GET", "/snapshot.json", headers={"Authorization": "Bearer s3cret"}, app=app)))
+        return response.headers["Last-Modified"]
+
+    publish(str(tmp_path), {"data": {"total": 10.0}, "updated_at": "t1"})
+    asyncio.run(service.refresh())
+    service.modified_at -= 60  # 模擬一分鐘前發布
+    first = last_modified()
+    publish(str(tmp_path), {"data": {"total": 10.0}, "updated_at": "t1"}, version=b"2")
+    asyncio.run(service.refresh())
+    assert last_modified() == first  # 重新輪詢但摘要未變
+    publish(str(tmp_path), {"data": {"total": 11.0}, "updated_at": "t2"}, version=b"3")
+    asyncio.run(service.refresh())
+    assert last_modified() != first
+
+
+def test_local_refresh_polls_system_cache_only(monkeypatch, local_server):
+    monkeypatch.setattr(data_layer, "_fetch_cache", data_layer.ConditionalFetchCache())
+    monkeypatch.setattr(data_layer, "_resilience", data_layer.ResilienceRegistry())
+    paths = []
+
+    async def system_cache(request):
+        paths.append(request.path)
+        return web.json_response([{"id": 1, "updated_at": "t1", "payload": {"total": 5.0, "settings": {"pin": "4321"}}}])
+
+    async def run():
+        async with local_server(system_cache, "/rest/v1/system_cache") as (url, _):
+            data_layer.configure(url.rsplit("/rest/", 1)[0], "k")
+            service = SummaryService({})
+            await service.refresh()
+            return service
+
+    try:
+        service = asyncio.run(run())
+    finally:
+        data_layer.configure("", "")
+    assert paths == ["/rest/v1/system_cache"]
+    assert json.loads(service.body)["global_total"] == 5.0
+    assert service.authorized(request("/snapshot.json?user=mingyu&pin=4321"))
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+import zlib
+
+import pytest
+
+from snapshot_store import FileSnapshotStore, SnapshotStore, create_snapshot_store, dumps_snapshot, loads_snapshot
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FileSnapshotStore(str(tmp_path))
+
+
+def test_snapshot_round_trip():
+    snapshot = {"data": {"loans": [{"幣種": "USD", "金額": 1.5}]}, "updated_at": "2024-01-01T00:00:00Z", "fetched_at": 1.25}
+    assert loads_snapshot(dumps_snapshot(snapshot)) == snapshot
+    assert loads_snapshot(None) is None
+
+
+@pytest.mark.parametrize("raw", [b"garbage", dumps_snapshot({"ok": 1})[:-4], zlib.compress(b"[1, 2]")])
+def test_corrupt_snapshot_raises_value_error(raw):
+    with pytest.raises(ValueError):
+        loads_snapshot(raw)
+
+
+def test_store_is_abstract():
+    with pytest.raises(TypeError):
+        SnapshotStore()
+
+
+def test_get_set(store):
+    assert store.get("lending:1") is None
+    store.set("lending:1", b"abc")
+    assert store.get("lending:1") == b"abc"
+    store.set("lending:1", b"")
+    assert store.get("lending:1") is None
+
+
+def test_concurrent_set_same_key_in_one_process(store):
+    # 同行程多執行緒寫入同一鍵：不應因暫存檔名相撞而 FileNotFoundError
+    errors, values = [], [bytes([i]) * 4096 for i in range(16)]
+
+    def writer(value):
+        try:
+            for _ in range(20): store.set("lending:1", value)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(v,)) for v in values]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert not errors
+    assert store.get("lending:1") in values
+    assert not [f for f in os.listdir(store.directory) if f.endswith(".tmp")]
+
+
+def test_lease_exclusive_until_expiry(store):
+    assert store.acquire_lease("poller", "a", 0.2)
+    assert not store.acquire_lease("poller", "b", 0.2)
+    assert store.acquire_lease("poller", "a", 0.2)  # 持有者續約
+    time.sleep(0.25)
+    assert store.acquire_lease("poller", "b", 0.2)
+    assert not store.acquire_lease("poller", "a", 0.2)
+
+
+def test_create_snapshot_store(tmp_path):
+    assert create_snapshot_store("local") is None
+    assert create_snapshot_store("") is None
+    assert isinstance(create_snapshot_store("file", str(tmp_path)), FileSnapshotStore)
+    with pytest.raises(ValueError):
+        create_snapshot_store("memcached")